@@ -0,0 +1,48 @@
+import asyncio
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from project3 import MONGO_URI, COVIDSEMESTER, perfCollection, periodStatsPipeline, periodStatsFromGroups
+
+# asyncio version of the queries the reports make one after another
+# -> Independent queries are sent at the same time (asyncio.gather), so a report waits for the slowest query instead of the sum
+# -> Keeps its own event loop, because the motor client is tied to the loop it was first used on
+# -> layout: "rows" or "embedded", where the grades are read from (see project3.perfCollection)
+class AsyncData:
+    def __init__(self, uri=MONGO_URI, layout="rows"):
+        self.loop = asyncio.new_event_loop()
+        self.client = AsyncIOMotorClient(uri, io_loop=self.loop)
+        self.db = self.client.covid19stud
+        self.layout = layout
+
+    # Runs a coroutine to completion (for the synchronous menu code)
+    def run(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def close(self):
+        self.client.close()
+        self.loop.close()
+
+    # Groups students on a criteria (same as project3.aggregateStudents)
+    # Returns a list of {"_id": value, "size": count}
+    async def groupStudents(self, criteria):
+        cursor = self.db.students.aggregate([
+            {"$group": {"_id": "$" + criteria, "size": {"$count": {}}}},
+            {"$sort": {"_id": 1}}
+        ])
+        return await cursor.to_list(length=None)
+
+    # Father and mother education counts at the same time
+    # Returns a tuple of lists (father, mother)
+    async def parentEducation(self):
+        return tuple(await asyncio.gather(self.groupStudents("father_educ"), self.groupStudents("mother_educ")))
+
+    # Pre and post statistics with one pipeline per period, run at the same time
+    # -> With the rows layout each pipeline only reads its half of performances (through the time_period index)
+    # Returns a dict -> {"pre": {subject: stats}, "post": {subject: stats}}
+    async def periodStats(self):
+        perfs = perfCollection(self.db, self.layout)
+        pre = perfs.aggregate(periodStatsPipeline("pre", {"time_period": {"$lt": COVIDSEMESTER}})).to_list(length=None)
+        post = perfs.aggregate(periodStatsPipeline("post", {"time_period": {"$gte": COVIDSEMESTER}})).to_list(length=None)
+        preRes, postRes = await asyncio.gather(pre, post)
+        return periodStatsFromGroups(preRes + postRes)
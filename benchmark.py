@@ -0,0 +1,114 @@
+import argparse
+import contextlib
+import io
+import json
+import platform
+import random
+import statistics
+import time
+
+import project3
+from datagen import SCALES, loadSynthetic
+
+#constants
+REPEAT = 3 # Timed runs per report
+SAMPLE_STUDENTS = 20 # Different sids tried for the single-student reports
+
+# Runs a report with scripted answers to its readInput() prompts and its output thrown away
+# Input
+#   1) report: function to run
+#   2) answers: list of answers (string) for readInput(), in order
+# Returns the time it took (seconds)
+def timeReport(report, answers):
+    answerIter = iter(answers)
+    readInput = project3.readInput
+    project3.readInput = lambda prompt="": next(answerIter)
+    try:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            report()
+        return time.perf_counter() - start
+    finally:
+        project3.readInput = readInput
+
+# studentDemographic answered from the bitmap index
+def bitmapDemographic(students):
+    project3.BITMAP_INDEX = True
+    try:
+        project3.studentDemographic(students)
+    finally:
+        project3.BITMAP_INDEX = False
+
+# The report paths to time
+# Input
+#   1) db: database with the data
+#   2) numStudents: number of students in it (int)
+#   3) rnd: random.Random used to pick sids
+# Returns a list of (name, function, answers)
+def reportCases(db, numStudents, rnd):
+    cases = []
+    for sid in rnd.sample(range(1, numStudents + 1), min(SAMPLE_STUDENTS, numStudents)):
+        cases.append(("studentInfo", lambda: project3.studentInfo(db.students, db.performances), [str(sid)]))
+        cases.append(("studentPerfChange", lambda: project3.studentPerfChange(db.performances), [str(sid)]))
+    cases.append(("allStudentPerfChange", lambda: project3.allStudentPerfChange(db.performances), []))
+    for choice in range(1, 7):
+        cases.append(("studentDemographic:" + str(choice), lambda: project3.studentDemographic(db.students), [str(choice)]))
+        cases.append(("studentDemographicBitmap:" + str(choice), lambda: bitmapDemographic(db.students), [str(choice)]))
+    for subj in project3.SUBJECTS:
+        for criteria in project3.CHANGE_CRITERIA:
+            cases.append(("showChangeByX:" + subj + ":" + criteria, lambda subj=subj, criteria=criteria: project3.showChangeByX(db[subj], subj, criteria), []))
+    cases.append(("overallAnalysis", lambda: project3.overallAnalysis(db), ["3a", "quit"]))
+    return cases
+
+# Times every report path
+# Input
+#   1) db: database with the data
+#   2) numStudents: number of students in it (int)
+#   3) repeat: timed runs per case (int)
+#   4) warm: keep the report cache between runs (bool), cold runs by default
+# Returns {report name: {"runs", "min", "median", "max"}} (seconds)
+def runBenchmark(db, numStudents, repeat=REPEAT, warm=False):
+    project3.NUMSTUDENTS = numStudents
+    times = {}
+    for name, report, answers in reportCases(db, numStudents, random.Random(0)):
+        for i in range(repeat):
+            if(not warm):
+                project3.REPORT_CACHE.clear()
+            times.setdefault(name, []).append(timeReport(report, answers))
+    # Single-student reports are grouped under one name (one run per sampled sid)
+    return {name: {"runs": len(runs), "min": min(runs), "median": statistics.median(runs), "max": max(runs)} for name, runs in times.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description="Time every report at a given dataset size")
+    parser.add_argument("--students", default="1.4k", help="number of students or a named scale (" + ", ".join(SCALES) + ")")
+    parser.add_argument("--uri", default=project3.MONGO_URI)
+    parser.add_argument("--db", default="covid19bench", help="database to benchmark (loaded with synthetic data if --load)")
+    parser.add_argument("--load", action="store_true", help="load a synthetic dataset of the given size first")
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--warm", action="store_true", help="keep the report cache between runs")
+    parser.add_argument("--output", default="bench_output.json")
+    args = parser.parse_args()
+
+    numStudents = SCALES[args.students] if args.students in SCALES else int(args.students)
+    db = project3.MongoClient(args.uri)[args.db]
+    if(args.load):
+        start = time.perf_counter()
+        loadSynthetic(db, numStudents)
+        print("Loaded", numStudents, "students in", round(time.perf_counter() - start, 2), "s")
+
+    results = {
+        "students": numStudents,
+        "repeat": args.repeat,
+        "warm": args.warm,
+        "python": platform.python_version(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "reports": runBenchmark(db, numStudents, args.repeat, args.warm)
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    for name, res in results["reports"].items():
+        print(name, round(res["median"] * 1000, 2), "ms")
+
+# Execute main
+if __name__ == "__main__":
+    main()
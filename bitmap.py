@@ -0,0 +1,151 @@
+from profiler import readInput
+from project3 import INCOME_BUCKETS, INCOME_LABELS, SCAN_BATCH_SIZE, bucketOf, collectionVersion
+
+try:
+    from pyroaring import BitMap # Compressed (roaring) bitmaps
+except ImportError: # Python ints are used as bitsets instead (bit i -> row i)
+    BitMap = None
+
+#constants
+FIELDS = ["school", "gender", "covidpos", "freelunch", "num_computers", "family_size", "father_educ", "mother_educ", "gradelvl", "household_income"] # Indexed student fields (household income by its ranges)
+BOOLFIELDS = ["school", "gender", "covidpos", "freelunch"]
+
+BITMAPS = {"index": None} # Index built by getBitmapIndex, rebuilt when students changes
+
+# Bitmap with the given rows set
+# Input
+#   1) rows: row numbers (iterable of int)
+#   2) size: number of rows in the index
+def makeBitmap(rows, size):
+    if(BitMap is not None):
+        return BitMap(rows)
+    bits = bytearray((size + 7) // 8)
+    for row in rows:
+        bits[row >> 3] |= 1 << (row & 7)
+    return int.from_bytes(bits, "little")
+
+# Number of rows set in a bitmap
+def popcount(bitmap):
+    if(isinstance(bitmap, int)):
+        return bitmap.bit_count()
+    return len(bitmap)
+
+# Dictionary-encoded bitmap index over the categorical student fields
+# -> Each field's distinct values are sorted into a dictionary (code = position), with one bitmap of the students (rows) per code
+# -> A conjunctive filter is an OR of the value bitmaps within a field, then an AND across fields
+# -> Counts are popcounts, so no document is read once the index is built
+class BitmapIndex:
+    def __init__(self, sids, values, bitmaps, version=None):
+        self.sids = sids # row -> student id (sorted)
+        self.values = values # {field: sorted list of values}
+        self.codes = {field: {value: code for code, value in enumerate(fieldValues)} for field, fieldValues in values.items()}
+        self.bitmaps = bitmaps # {field: list of bitmaps, one per code}
+        self.all = makeBitmap(range(len(sids)), len(sids))
+        self.version = version
+
+    # Students matching every filter
+    # Input: filters -> {field: list of values} (household income as its bucket id, see parseFilters)
+    # Returns a bitmap of rows
+    def match(self, filters):
+        res = self.all
+        for field, values in filters.items():
+            fieldBits = makeBitmap((), len(self.sids))
+            for value in values:
+                code = self.codes[field].get(value)
+                if(code is not None): # A value no student has matches nobody
+                    fieldBits = fieldBits | self.bitmaps[field][code]
+            res = res & fieldBits
+        return res
+
+    # Number of students matching every filter
+    def count(self, filters=None):
+        return popcount(self.match(filters or {}))
+
+    # Same result as project3.demographicCounts, for the students matching the filters
+    # Input
+    #   1) criteria: field to break down (string)
+    #   2) filters: {field: list of values} (optional)
+    # Returns a list of {"_id": value, "size": count} sorted by value
+    def groupCounts(self, criteria, filters=None):
+        selected = self.match(filters or {})
+        res = []
+        for value, bits in zip(self.values[criteria], self.bitmaps[criteria]):
+            size = popcount(bits & selected)
+            if(size > 0):
+                res.append({"_id": INCOME_LABELS[value] if criteria == "household_income" else value, "size": size})
+        return res
+
+# Builds the index with one scan of students
+# Input
+#   1) students: Collection of students
+#   2) batchSize: documents per getMore
+# Returns a BitmapIndex
+def buildBitmapIndex(students, batchSize=SCAN_BATCH_SIZE):
+    rows = {field: {} for field in FIELDS} # field -> value -> list of rows
+    sids = []
+    projection = {field: 1 for field in FIELDS}
+    for row, student in enumerate(students.find({}, projection, batch_size=batchSize).sort("_id", 1)):
+        sids.append(student["_id"])
+        for field in FIELDS:
+            value = bucketOf(student[field], INCOME_BUCKETS) if field == "household_income" else student[field]
+            rows[field].setdefault(value, []).append(row)
+    values = {field: sorted(rows[field]) for field in FIELDS}
+    bitmaps = {field: [makeBitmap(rows[field][value], len(sids)) for value in values[field]] for field in FIELDS}
+    return BitmapIndex(sids, values, bitmaps)
+
+# Gets the index from memory, rebuilt if students has changed
+# Input
+#   1) db: main database
+#   2) batchSize: documents per getMore when the index is built
+# Returns a BitmapIndex
+def getBitmapIndex(db, batchSize=SCAN_BATCH_SIZE):
+    version = collectionVersion(db, ["students"])
+    index = BITMAPS["index"]
+    if(index is None or index.version != version):
+        index = buildBitmapIndex(db.students, batchSize)
+        index.version = version
+        BITMAPS["index"] = index
+    return index
+
+# Reads "field=value" pairs (several values separated by commas), ex: "school=1 freelunch=1 household_income=<50000"
+# -> Booleans as 0/1 or true/false, household income as one of its ranges
+# Returns a dict -> {field: list of values}
+def parseFilters(text):
+    filters = {}
+    for part in text.split():
+        field, _, values = part.partition("=")
+        if(field not in FIELDS):
+            raise ValueError("Unknown field " + field)
+        filters[field] = []
+        for value in values.split(","):
+            if(field == "household_income"):
+                if(value not in INCOME_LABELS):
+                    raise ValueError("Unknown household_income " + value)
+                filters[field].append(INCOME_LABELS.index(value))
+            elif(field in BOOLFIELDS):
+                filters[field].append(value.lower() in ("1", "true", "yes"))
+            else:
+                filters[field].append(int(value))
+    return filters
+
+# Asks for a filter and a field, and prints how many students match and their breakdown by the field
+# Input
+#   1) db: main database
+#   2) batchSize: documents per getMore when the index is built
+# Returns nothing
+def filteredDemographic(db, batchSize=SCAN_BATCH_SIZE):
+    index = getBitmapIndex(db, batchSize)
+    print("Fields:", ", ".join(FIELDS), "| household_income:", ", ".join(INCOME_LABELS))
+    try:
+        filters = parseFilters(readInput("Filter (ex: 'school=1 freelunch=1 num_computers=0,1', empty for everyone): "))
+        criteria = readInput("Break down by (a field, empty for none): ").strip()
+        if(criteria and criteria not in FIELDS):
+            raise ValueError("Unknown field " + criteria)
+    except ValueError as e:
+        print("Please state a valid input (" + str(e) + ")")
+        return
+    matched = index.count(filters)
+    print("\t", matched, "students match (", round(matched / len(index.sids) * 100, 2) if index.sids else 0, "% of students )")
+    if(criteria and matched):
+        for sr in index.groupCounts(criteria, filters):
+            print("\t\t", criteria, sr["_id"], ":", round(sr["size"] / matched * 100, 2), "%")
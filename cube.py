@@ -0,0 +1,205 @@
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+from profiler import readInput
+from project3 import SUBJECTS, CHANGE_BUCKETS, CHANGE_LABELS, INCOME_BUCKETS, INCOME_LABELS, EDUCATION, FREELUNCH, GENDER, SCHOOL, SCAN_BATCH_SIZE, bucketOf, calcPercentChange, collectionVersion, perfCollection, studentChangePipeline
+
+#constants
+CUBE_FILE = ".cube.npz" # Where the built cube is cached
+DIMENSIONS = ["subject", "change", "school", "gender", "freelunch", "family_size", "income", "father_educ", "mother_educ", "num_computers", "gradelvl"]
+STUDENT_DIMENSIONS = ["school", "gender", "freelunch", "family_size", "father_educ", "mother_educ", "num_computers", "gradelvl"] # Read straight from the student document
+MEASURES = ["count", "change", "pre", "post"] # Per cell: number of students, and sums of their percent changes, pre averages and post averages
+LABELS = {"subject": SUBJECTS, "change": CHANGE_LABELS, "income": INCOME_LABELS} # Dimensions stored as an index into a list of labels
+
+CUBE = {"cube": None} # Cube loaded by getCube, rebuilt when the collections change
+CUBE_LOCK = threading.Lock() # One build at a time (the service calls getCube from several threads)
+
+# Pre-aggregated counts and sums over subject x change bucket x every demographic
+# -> One row per non-empty cell (coords: dimension codes, measures: count and sums), so its size is bounded by students x subjects
+# -> slice() keeps the cells matching some dimension values, rollup() sums the cells over the dimensions not grouped on
+# -> Answers come from a few thousand rows in memory, without touching the collections
+class Cube:
+    def __init__(self, coords, measures, version=None):
+        self.coords = coords # (cells, len(DIMENSIONS)) int64
+        self.measures = measures # (cells, len(MEASURES)) float64
+        self.version = version
+
+    # Keeps the cells that match every filter
+    # Input: filters -> {dimension: value or list of values} (values as shown, ex: {"subject": "math", "income": "<50000"})
+    # Returns a Cube
+    def slice(self, filters):
+        mask = np.ones(len(self.coords), dtype=bool)
+        for dim, values in filters.items():
+            if(not isinstance(values, (list, tuple, set))):
+                values = [values]
+            codes = [encodeValue(dim, value) for value in values]
+            mask &= np.isin(self.coords[:, DIMENSIONS.index(dim)], codes)
+        return Cube(self.coords[mask], self.measures[mask], self.version)
+
+    # Sums the cells over every dimension not in groupBy
+    # Input: groupBy -> list of dimensions (empty for one total)
+    # Returns a list of {dimension: value, ..., "students", "avgChange", "avgPre", "avgPost"} sorted by the group values
+    #   (a student is in one cell per subject, so "students" counts student-subject pairs unless subject is sliced or grouped on)
+    def rollup(self, groupBy=()):
+        if(len(self.coords) == 0):
+            return []
+        cols = [DIMENSIONS.index(dim) for dim in groupBy]
+        keys, inverse = np.unique(self.coords[:, cols], axis=0, return_inverse=True)
+        sums = np.zeros((len(keys), len(MEASURES)))
+        np.add.at(sums, inverse.reshape(-1), self.measures)
+        rows = []
+        for key, total in zip(keys, sums):
+            row = {dim: decodeValue(dim, code) for dim, code in zip(groupBy, key)}
+            count = total[MEASURES.index("count")]
+            row["students"] = int(count)
+            row["avgChange"] = round(float(total[MEASURES.index("change")] / count), 2)
+            row["avgPre"] = round(float(total[MEASURES.index("pre")] / count), 2)
+            row["avgPost"] = round(float(total[MEASURES.index("post")] / count), 2)
+            rows.append(row)
+        return rows
+
+    # slice() then rollup()
+    def query(self, filters=None, groupBy=()):
+        return self.slice(filters or {}).rollup(groupBy)
+
+# Dimension value -> code stored in the cube (labels -> their index, booleans -> 0/1)
+def encodeValue(dim, value):
+    if(dim in LABELS):
+        return LABELS[dim].index(value) if isinstance(value, str) else int(value)
+    return int(value)
+
+# Code stored in the cube -> dimension value as shown
+def decodeValue(dim, code):
+    if(dim in LABELS):
+        return LABELS[dim][code]
+    if(dim in ("school", "gender", "freelunch")):
+        return bool(code)
+    return int(code)
+
+# Builds the cube with one pass over the per-student pre/post averages (the aggregation behind the subject collections)
+# Input
+#   1) db: main database
+#   2) layout: "rows" or "embedded", where the grades are read from
+#   3) batchSize: documents per getMore
+# Returns a Cube
+def buildCube(db, layout="rows", batchSize=SCAN_BATCH_SIZE):
+    cells = {} # dimension codes -> [count, sum of changes, sum of pre averages, sum of post averages]
+    for sr in perfCollection(db, layout).aggregate(studentChangePipeline(layout=layout), allowDiskUse=True, batchSize=batchSize):
+        student = sr["student"]
+        demographics = [int(student[dim]) for dim in STUDENT_DIMENSIONS]
+        income = bucketOf(student["household_income"], INCOME_BUCKETS)
+        for s, subj in enumerate(SUBJECTS):
+            preAvg, postAvg = sr[subj + "_pre"], sr[subj + "_post"]
+            if(not preAvg or postAvg is None): # No percent change without pre and post grades
+                continue
+            change = calcPercentChange(preAvg, postAvg)
+            key = (s, bucketOf(change, CHANGE_BUCKETS), demographics[0], demographics[1], demographics[2], demographics[3], income) + tuple(demographics[4:])
+            cell = cells.get(key)
+            if(cell is None):
+                cell = cells[key] = [0, 0.0, 0.0, 0.0]
+            cell[0] += 1
+            cell[1] += change
+            cell[2] += preAvg
+            cell[3] += postAvg
+    coords = np.array(list(cells.keys()), dtype=np.int64).reshape(-1, len(DIMENSIONS))
+    measures = np.array(list(cells.values()), dtype=np.float64).reshape(-1, len(MEASURES))
+    return Cube(coords, measures)
+
+# Version of the collections the cube is built from (changes whenever they change)
+def cubeVersion(db, layout="rows"):
+    return repr(collectionVersion(db, ["students", perfCollection(db, layout).name]))
+
+# Gets the cube, from memory or from CUBE_FILE if the collections have not changed, else rebuilds and saves it
+# -> Threads asking at the same time wait for one build, then all get that cube
+# -> Saved to a temporary file of its own, then swapped in, so other processes never read a half-written file
+# Input
+#   1) db: main database
+#   2) layout: "rows" or "embedded", where the grades are read from
+#   3) batchSize: documents per getMore when the cube is built
+#   4) path: cache file
+# Returns a Cube
+def getCube(db, layout="rows", batchSize=SCAN_BATCH_SIZE, path=CUBE_FILE):
+    version = cubeVersion(db, layout)
+    with CUBE_LOCK:
+        cube = CUBE["cube"]
+        if(cube is not None and cube.version == version):
+            return cube
+        cube = None
+        if(os.path.exists(path)):
+            saved = np.load(path)
+            if(str(saved["version"]) == version):
+                cube = Cube(saved["coords"], saved["measures"], version)
+        if(cube is None):
+            print("Building cube...")
+            cube = buildCube(db, layout, batchSize)
+            cube.version = version
+            with tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(path)), suffix=".npz", delete=False) as f:
+                np.savez(f, coords=cube.coords, measures=cube.measures, version=np.array(version))
+            os.replace(f.name, path)
+        CUBE["cube"] = cube
+        return cube
+
+# Reads a typed dimension value (labels as shown, booleans as 0/1 or true/false, numbers)
+def parseValue(dim, value):
+    if(dim in LABELS):
+        if(value not in LABELS[dim]):
+            raise ValueError("Unknown " + dim + " " + value)
+        return value
+    if(dim in ("school", "gender", "freelunch")):
+        return value.lower() in ("1", "true", "yes")
+    return int(value)
+
+# Reads "dimension=value" pairs (several values separated by commas), ex: "school=1 income=<50000 subject=math"
+# Returns a dict -> {dimension: list of values}
+def parseFilters(text):
+    filters = {}
+    for part in text.split():
+        dim, _, values = part.partition("=")
+        if(dim not in DIMENSIONS):
+            raise ValueError("Unknown dimension " + dim)
+        filters[dim] = [parseValue(dim, value) for value in values.split(",")]
+    return filters
+
+# Formats a dimension value for printing (same wording as the reports)
+def valueLabel(dim, value):
+    if(dim == "school"):
+        return SCHOOL[value]
+    if(dim == "gender"):
+        return GENDER[value]
+    if(dim == "freelunch"):
+        return FREELUNCH[value]
+    if(dim in ("father_educ", "mother_educ")):
+        return dim + ": " + EDUCATION[value]
+    return dim + ": " + str(value)
+
+# Asks for a slice and a roll-up and prints the answer from the cube
+# Input
+#   1) db: main database
+#   2) layout: "rows" or "embedded", where the grades are read from
+#   3) batchSize: documents per getMore when the cube is built
+# Returns nothing
+def cubeQuery(db, layout="rows", batchSize=SCAN_BATCH_SIZE):
+    cube = getCube(db, layout, batchSize)
+    print("Dimensions:", ", ".join(DIMENSIONS))
+    print("Subjects:", ", ".join(SUBJECTS), "| income:", ", ".join(INCOME_LABELS))
+    try:
+        filters = parseFilters(readInput("Slice (ex: 'school=1 income=<50000 subject=math', empty for everything): "))
+        groupBy = readInput("Group by (ex: 'change gender', empty for the total): ").split()
+        for dim in groupBy:
+            if(dim not in DIMENSIONS):
+                raise ValueError("Unknown dimension " + dim)
+        rows = cube.query(filters, groupBy)
+    except ValueError as e:
+        print("Please state a valid input (" + str(e) + ")")
+        return
+    if(not rows):
+        print("\t No students")
+        return
+    if("subject" not in filters and "subject" not in groupBy):
+        print("\t (every subject is counted, so each student is counted once per subject)")
+    for row in rows:
+        title = ", ".join(valueLabel(dim, row[dim]) if dim not in LABELS else dim + ": " + row[dim] for dim in groupBy) or "All"
+        print("\t", title, "->", row["students"], "students, average percent change", row["avgChange"], "(pre", row["avgPre"], "/ post", row["avgPost"], ")")
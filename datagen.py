@@ -0,0 +1,114 @@
+import argparse
+import random
+
+from pymongo import MongoClient
+
+from migrate import refreshEmbedded
+from project3 import MONGO_URI, SUBJECTS, NUMSEMESTERS, COVIDSEMESTER, beginPerformanceWrite, bumpVersion, endPerformanceWrite, ensureIndexes, incAccumulators, rebuildChangeCollections, rebuildSummaries
+
+#constants
+SCALES = {"1.4k": 1400, "140k": 140000, "14M": 14000000} # Named dataset sizes (number of students)
+INSERT_BATCH_SIZE = 5000 # Documents per insert_many
+
+# Makes a random student with the same fields as the students collection
+# -> Income depends on the school, free lunch and computers depend on income (like the Kaggle data)
+# Input
+#   1) sid: student id (int)
+#   2) rnd: random.Random
+# Returns the student document
+def makeStudent(sid, rnd):
+    school = rnd.random() < 0.5 # True is School B (Poor)
+    if(school):
+        income = int(rnd.gauss(55000, 15000))
+    else:
+        income = int(rnd.gauss(105000, 25000))
+    income = max(15000, income)
+    return {
+        "_id": sid,
+        "school": school,
+        "gradelvl": rnd.randint(9, 12),
+        "gender": rnd.random() < 0.5,
+        "covidpos": rnd.random() < 0.3,
+        "household_income": income,
+        "freelunch": income < 60000 and rnd.random() < 0.8,
+        "num_computers": min(4, max(0, int(rnd.gauss(income / 40000, 1)))),
+        "family_size": rnd.randint(2, 8),
+        "father_educ": rnd.randint(0, 4),
+        "mother_educ": rnd.randint(0, 4)
+    }
+
+# Makes the six semesters of grades for a student
+# -> Grades drop after COVID, more for students with less income and fewer computers
+# Input
+#   1) student: the student document
+#   2) rnd: random.Random
+# Returns a list of 6 performance documents
+def makePerformances(student, rnd):
+    base = 60 + student["household_income"] / 10000 + 2 * (student["father_educ"] + student["mother_educ"])
+    drop = 5 + max(0, 3 - student["num_computers"]) * 4 + (6 if student["freelunch"] else 0)
+    perfs = []
+    for t in range(NUMSEMESTERS):
+        perf = {"sid": student["_id"], "time_period": t}
+        for subj in SUBJECTS:
+            grade = rnd.gauss(base, 8)
+            if(t >= COVIDSEMESTER):
+                grade -= rnd.gauss(drop, 4)
+            perf[subj] = int(min(100, max(0, grade)))
+        perfs.append(perf)
+    return perfs
+
+# Loads a synthetic dataset into students and performances (streamed in batches, so memory stays bounded)
+# Input
+#   1) db: database to load into
+#   2) numStudents: number of students (int)
+#   3) seed: random seed, the same seed gives the same data
+#   4) drop: drop the collections first, with the subject collections, summaries, semesters and meta (bool)
+#   5) buildChanges: also rebuild the per-subject change collections and the summaries (bool)
+# Returns nothing
+def loadSynthetic(db, numStudents, seed=0, drop=True, buildChanges=True):
+    if(drop): # Everything derived from the old data too (a smaller reload would leave stale documents behind)
+        for name in ["students", "performances", "summaries", "accumulators", "semesters", "meta"] + SUBJECTS:
+            db[name].drop()
+    version = beginPerformanceWrite(db)
+    rnd = random.Random(seed)
+    studentBatch = []
+    perfBatch = []
+    for sid in range(1, numStudents + 1):
+        student = makeStudent(sid, rnd)
+        studentBatch.append(student)
+        perfBatch += makePerformances(student, rnd)
+        if(len(perfBatch) >= INSERT_BATCH_SIZE):
+            db.students.insert_many(studentBatch, ordered=False)
+            db.performances.insert_many(perfBatch, ordered=False)
+            incAccumulators(db, perfBatch)
+            studentBatch = []
+            perfBatch = []
+    if(studentBatch):
+        db.students.insert_many(studentBatch, ordered=False)
+        db.performances.insert_many(perfBatch, ordered=False)
+        incAccumulators(db, perfBatch)
+    endPerformanceWrite(db, version)
+    bumpVersion(db, ["students", "accumulators"])
+    refreshEmbedded(db) # A database migrated to semesters gets the new grades too
+    ensureIndexes(db)
+    if(buildChanges):
+        rebuildChangeCollections(db, restart=True)
+        rebuildSummaries(db)
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic students/performances dataset")
+    parser.add_argument("--students", default="1.4k", help="number of students or a named scale (" + ", ".join(SCALES) + ")")
+    parser.add_argument("--uri", default=MONGO_URI)
+    parser.add_argument("--db", default="covid19bench", help="database to load into")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-changes", action="store_true", help="don't build the per-subject change collections or the summaries")
+    args = parser.parse_args()
+
+    numStudents = SCALES[args.students] if args.students in SCALES else int(args.students)
+    db = MongoClient(args.uri)[args.db]
+    loadSynthetic(db, numStudents, args.seed, True, not args.no_changes)
+    print("Loaded", numStudents, "students into", args.db)
+
+# Execute main
+if __name__ == "__main__":
+    main()
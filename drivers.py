@@ -0,0 +1,75 @@
+import numpy as np
+
+from project3 import SUBJECTS
+from snapshot import DEMOGRAPHICS, loadSnapshot
+
+# Builds the feature matrix (one column per demographic) and the target matrix (one column per subject's percent change)
+# -> Students missing a subject's change (no pre or post grades) are left out
+# Input: snapshot -> Snapshot
+# Returns a tuple (features (students, demographics), changes (students, subjects))
+def driverMatrices(snapshot):
+    features = np.column_stack([np.asarray(snapshot.columns[field], dtype=np.float64) for field in DEMOGRAPHICS])
+    changes = snapshot.studentChanges()
+    valid = np.all(np.isfinite(changes), axis=1)
+    return (features[valid], changes[valid])
+
+# Correlation of every demographic with every subject's percent change, and one linear regression per subject
+# -> All subjects at once: standardized X and Y, so X^T Y / n is the correlation matrix and one least squares solve fits every subject
+# -> Coefficients are per standard deviation of the demographic, so they can be compared with each other
+# Input: snapshot -> Snapshot
+# Returns a dict ->
+#   "students": number of students used
+#   "correlation": {demographic: {subject: r}}
+#   "coefficients": {demographic: {subject: percent change points per standard deviation}}
+#   "intercept", "r2": {subject: value}
+def changeDrivers(snapshot):
+    features, changes = driverMatrices(snapshot)
+    n = len(features)
+    if(n < 2):
+        return {"students": n, "correlation": {}, "coefficients": {}, "intercept": {}, "r2": {}}
+    xStd = features.std(axis=0)
+    yStd = changes.std(axis=0)
+    xStd[xStd == 0] = 1 # A demographic with one value has no correlation (its standardized column is all 0)
+    yStd[yStd == 0] = 1
+    xz = (features - features.mean(axis=0)) / xStd
+    yz = (changes - changes.mean(axis=0)) / yStd
+    correlation = xz.T @ yz / n # (demographics, subjects)
+
+    design = np.column_stack([np.ones(n), xz])
+    beta, _, _, _ = np.linalg.lstsq(design, changes, rcond=None) # (1 + demographics, subjects)
+    residual = changes - design @ beta
+    total = ((changes - changes.mean(axis=0)) ** 2).sum(axis=0)
+    r2 = 1 - (residual ** 2).sum(axis=0) / np.where(total > 0, total, 1)
+
+    res = {"students": n, "correlation": {}, "coefficients": {}}
+    for i, field in enumerate(DEMOGRAPHICS):
+        res["correlation"][field] = {subj: round(float(correlation[i, j]), 3) for j, subj in enumerate(SUBJECTS)}
+        res["coefficients"][field] = {subj: round(float(beta[i + 1, j]), 3) for j, subj in enumerate(SUBJECTS)}
+    res["intercept"] = {subj: round(float(beta[0, j]), 3) for j, subj in enumerate(SUBJECTS)}
+    res["r2"] = {subj: round(float(r2[j]), 3) for j, subj in enumerate(SUBJECTS)}
+    return res
+
+# Prints a demographics x subjects table
+def printDriverTable(title, values):
+    print("\n  " + title)
+    print("\t" + "".ljust(18) + "".join(subj.rjust(11) for subj in SUBJECTS))
+    for field, row in values.items():
+        print("\t" + field.ljust(18) + "".join(str(row[subj]).rjust(11) for subj in SUBJECTS))
+
+# Displays what drives the COVID grade change -> correlations and regression coefficients of every demographic for every subject
+# Input
+#   1) db: main database
+#   2) snapshot: in-memory Snapshot (loaded or built if not given)
+#   3) layout: "rows" or "embedded", where the grades are read from when the Snapshot is built
+# Returns nothing
+def showChangeDrivers(db, snapshot=None, layout="rows"):
+    if(snapshot is None):
+        snapshot = loadSnapshot(db, layout)
+    res = changeDrivers(snapshot)
+    print("What drives the percent change (", res["students"], "students, a positive change is a drop)")
+    if(not res["correlation"]):
+        print("\t Not enough students")
+        return
+    printDriverTable("Correlation with the percent change", res["correlation"])
+    printDriverTable("Regression coefficients (percent change points per standard deviation)", res["coefficients"])
+    print("\t" + "R squared".ljust(18) + "".join(str(res["r2"][subj]).rjust(11) for subj in SUBJECTS))
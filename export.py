@@ -0,0 +1,116 @@
+import argparse
+
+import pyarrow as pa
+import pyarrow.ipc
+import pyarrow.parquet as pq
+from pymongo import MongoClient
+
+from project3 import MONGO_URI, SUBJECTS, calcPercentChange, detectLayout, perfCollection, studentChangePipeline
+
+#constants
+EXPORT_BATCH_SIZE = 50000 # Students per row group (record batch), the most held in memory at once
+CURSOR_BATCH_SIZE = 1000 # Documents per getMore while streaming
+STUDENT_COLUMNS = [
+    ("sid", pa.int64()),
+    ("school", pa.bool_()),
+    ("gradelvl", pa.int8()),
+    ("gender", pa.bool_()),
+    ("covidpos", pa.bool_()),
+    ("household_income", pa.int64()),
+    ("freelunch", pa.bool_()),
+    ("num_computers", pa.int8()),
+    ("family_size", pa.int8()),
+    ("father_educ", pa.int8()),
+    ("mother_educ", pa.int8())
+]
+FORMATS = {".parquet": "parquet", ".arrow": "arrow", ".feather": "arrow"} # File extension -> format
+
+# The exported table's columns -> student fields, then pre/post averages and percent change per subject
+# Returns a pyarrow.Schema
+def changeSchema():
+    fields = [pa.field(name, arrowType) for name, arrowType in STUDENT_COLUMNS]
+    for subj in SUBJECTS:
+        fields.append(pa.field(subj + "_pre", pa.float64()))
+        fields.append(pa.field(subj + "_post", pa.float64()))
+        fields.append(pa.field(subj + "_change", pa.float64()))
+    return pa.schema(fields)
+
+# Adds one student (a studentChangePipeline result) to the column lists
+# Input
+#   1) columns: dict -> {column name: list of values}
+#   2) sr: {"_id": sid, "<subject>_pre", "<subject>_post", "student": student document}
+def addRow(columns, sr):
+    student = sr["student"]
+    columns["sid"].append(sr["_id"])
+    for name, arrowType in STUDENT_COLUMNS[1:]:
+        columns[name].append(student.get(name))
+    for subj in SUBJECTS:
+        preAvg, postAvg = sr[subj + "_pre"], sr[subj + "_post"]
+        columns[subj + "_pre"].append(preAvg)
+        columns[subj + "_post"].append(postAvg)
+        if(preAvg and postAvg is not None):
+            columns[subj + "_change"].append(calcPercentChange(preAvg, postAvg))
+        else: # No pre-COVID grades (or all 0) -> no percent change
+            columns[subj + "_change"].append(None)
+
+# Opens a Parquet or Arrow IPC (Feather v2) writer -> both take write_batch() and close()
+# -> Parquet writes one row group per batch
+# Input
+#   1) path: output file
+#   2) schema: pyarrow.Schema
+#   3) fmt: "parquet" or "arrow"
+def openWriter(path, schema, fmt):
+    if(fmt == "parquet"):
+        return pq.ParquetWriter(path, schema, compression="zstd")
+    return pa.ipc.new_file(path, schema, options=pa.ipc.IpcWriteOptions(compression="zstd"))
+
+# Streams every student joined with their per-subject pre/post averages and percent changes into a columnar file
+# -> The same aggregation as rebuildChangeCollections, read with a cursor and written one row group at a time
+# -> Memory stays bounded by batchSize students, whatever the number of students
+# Input
+#   1) db: main database
+#   2) path: output file
+#   3) fmt: "parquet" or "arrow"
+#   4) batchSize: students per row group
+#   5) layout: "rows" or "embedded", where the grades are read from
+# Returns the number of students written
+def exportChanges(db, path, fmt="parquet", batchSize=EXPORT_BATCH_SIZE, layout="rows"):
+    schema = changeSchema()
+    writer = openWriter(path, schema, fmt)
+    columns = {name: [] for name in schema.names}
+    written = 0
+    try:
+        for sr in perfCollection(db, layout).aggregate(studentChangePipeline(layout=layout), allowDiskUse=True, batchSize=CURSOR_BATCH_SIZE):
+            addRow(columns, sr)
+            if(len(columns["sid"]) >= batchSize):
+                writer.write_batch(pa.RecordBatch.from_pydict(columns, schema=schema))
+                written += len(columns["sid"])
+                columns = {name: [] for name in schema.names}
+        if(columns["sid"]):
+            writer.write_batch(pa.RecordBatch.from_pydict(columns, schema=schema))
+            written += len(columns["sid"])
+    finally:
+        writer.close()
+    return written
+
+def main():
+    parser = argparse.ArgumentParser(description="Export every student's per-subject pre/post averages and percent changes to Parquet or Arrow")
+    parser.add_argument("output", help="output file (.parquet, .arrow or .feather)")
+    parser.add_argument("--format", choices=["parquet", "arrow"], help="file format (default: from the file extension, else parquet)")
+    parser.add_argument("--uri", default=MONGO_URI)
+    parser.add_argument("--db", default="covid19stud")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE, help="students per row group")
+    parser.add_argument("--layout", choices=["auto", "rows", "embedded"], default="auto", help="where the grades are read from: performances (rows), semesters (embedded) or whichever migrate.py last switched to (auto)")
+    args = parser.parse_args()
+
+    fmt = args.format
+    if(fmt is None):
+        fmt = next((f for ext, f in FORMATS.items() if args.output.endswith(ext)), "parquet")
+    db = MongoClient(args.uri)[args.db]
+    layout = detectLayout(db) if args.layout == "auto" else args.layout
+    written = exportChanges(db, args.output, fmt, args.batch_size, layout)
+    print("Exported", written, "students to", args.output)
+
+# Execute main
+if __name__ == "__main__":
+    main()
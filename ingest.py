@@ -0,0 +1,230 @@
+import argparse
+import csv
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from pymongo import MongoClient, ReplaceOne
+from pymongo.errors import BulkWriteError
+
+from migrate import refreshEmbedded
+from project3 import MONGO_URI, SUBJECTS, NUMSEMESTERS, beginPerformanceWrite, bumpVersion, changeDocument, endPerformanceWrite, endSummaryWrite, ensureIndexes, incAccumulators, resetAccumulators, resetSummaries, summaryDocument
+
+#constants
+# Database field -> CSV column (the Kaggle CSV has one row per student per semester)
+CSV_COLUMNS = {
+    "sid": "studentID",
+    "school": "school",
+    "gradelvl": "gradelevel",
+    "gender": "gender",
+    "covidpos": "covidpos",
+    "household_income": "householdincome",
+    "freelunch": "freelunch",
+    "num_computers": "numcomputers",
+    "family_size": "familysize",
+    "father_educ": "fathereduc",
+    "mother_educ": "mothereduc",
+    "time_period": "timeperiod",
+    "reading": "readingscore",
+    "writing": "writingscore",
+    "math": "mathscore",
+    "readingSL": "readingscoreSL",
+    "writingSL": "writingscoreSL",
+    "mathSL": "mathscoreSL"
+}
+STUDENT_FIELDS = ["school", "gradelvl", "gender", "covidpos", "household_income", "freelunch", "num_computers", "family_size", "father_educ", "mother_educ"]
+BOOL_FIELDS = ["school", "gender", "covidpos", "freelunch"]
+INGEST_BATCH_SIZE = 5000 # Documents per insert_many
+MAX_PENDING_BATCHES = 2 # Batches waiting per writer thread (keeps memory bounded)
+
+# Reads a 0/1 or True/False value
+def parseBool(value):
+    return value.strip().lower() in ("1", "true", "yes")
+
+# Splits a CSV row into its student document and its performance document
+# Input: row (dict from csv.DictReader)
+# Returns a tuple (student, performance)
+def splitRow(row):
+    sid = int(row[CSV_COLUMNS["sid"]])
+    student = {"_id": sid}
+    for field in STUDENT_FIELDS:
+        value = row[CSV_COLUMNS[field]]
+        if(field in BOOL_FIELDS):
+            student[field] = parseBool(value)
+        else:
+            student[field] = int(float(value))
+    timePeriod = int(row[CSV_COLUMNS["time_period"]])
+    perf = {"_id": str(sid) + "-" + str(timePeriod), "sid": sid, "time_period": timePeriod} # Fixed _id, so loading a row twice is a duplicate
+    for subj in SUBJECTS:
+        perf[subj] = int(float(row[CSV_COLUMNS[subj]]))
+    return (student, perf)
+
+# Sends batches to MongoDB, on a thread pool if workers > 0
+# -> Unordered insert_many, so one duplicate doesn't stop the rest of the batch
+# -> Inserted performances are added to the accumulators (pre/post running totals)
+# -> Counts what the server actually wrote per collection (inserted, upserted and modified documents)
+class BatchWriter:
+    def __init__(self, db, workers=0):
+        self.db = db
+        self.pool = ThreadPoolExecutor(max_workers=workers) if workers > 0 else None
+        self.maxPending = max(1, workers) * MAX_PENDING_BATCHES
+        self.pending = []
+        self.duplicates = 0
+        self.written = {} # collection name -> {"inserted", "upserted", "modified"}
+        self.lock = threading.Lock() # The counts are updated from the writer threads
+
+    # Adds a batch's result to the counts
+    def count(self, name, inserted=0, upserted=0, modified=0, duplicates=0):
+        with self.lock:
+            written = self.written.setdefault(name, {"inserted": 0, "upserted": 0, "modified": 0})
+            written["inserted"] += inserted
+            written["upserted"] += upserted
+            written["modified"] += modified
+            self.duplicates += duplicates
+
+    def insert(self, name, docs):
+        self.submit(self.insertNow, name, docs)
+
+    def replace(self, name, docs):
+        self.submit(self.replaceNow, name, docs)
+
+    def submit(self, write, name, docs):
+        if(self.pool is None):
+            write(name, docs)
+            return
+        self.pending.append(self.pool.submit(write, name, docs))
+        while(len(self.pending) >= self.maxPending): # Wait for the oldest batch so memory stays bounded
+            self.pending.pop(0).result()
+
+    def insertNow(self, name, docs):
+        try:
+            self.db[name].insert_many(docs, ordered=False)
+        except BulkWriteError as e: # Already loaded documents (duplicate _id) are skipped
+            errors = e.details.get("writeErrors", [])
+            if(any(err["code"] != 11000 for err in errors)):
+                raise
+            skipped = {err["index"] for err in errors}
+            docs = [doc for i, doc in enumerate(docs) if i not in skipped]
+            self.count(name, duplicates=len(errors))
+        self.count(name, inserted=len(docs))
+        if(name == "performances"): # Only the performances actually inserted go into the running totals
+            incAccumulators(self.db, docs)
+
+    def replaceNow(self, name, docs):
+        res = self.db[name].bulk_write([ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in docs], ordered=False)
+        self.count(name, upserted=res.upserted_count, modified=res.modified_count)
+
+    def close(self):
+        if(self.pool is not None):
+            for future in self.pending:
+                future.result()
+            self.pool.shutdown()
+
+# Streams the CSV into students and performances, and builds the summaries and per-subject change collections in the same pass
+# -> Students are written the first time their sid is seen, performances in batches
+# -> A student's semesters are kept only until all of them have been read
+# Input
+#   1) db: main database
+#   2) path: CSV file
+#   3) workers: writer threads (0 writes on the main thread)
+#   4) batchSize: documents per insert_many
+# Returns a dict ->
+#   "students", "performances": documents inserted (rows already loaded are not counted)
+#   "summaries": {"upserted": new summaries, "modified": summaries replaced with different values}
+#   "duplicates": documents skipped because they were already loaded
+#   "incomplete": students without all semesters
+def ingestCsv(db, path, workers=0, batchSize=INGEST_BATCH_SIZE):
+    version = beginPerformanceWrite(db)
+    writer = BatchWriter(db, workers)
+    seen = set()
+    partial = {} # sid -> {"student", "perfs": semesters read so far}
+    students, perfs, summaries = [], [], []
+    changes = {subj: [] for subj in SUBJECTS}
+
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            student, perf = splitRow(row)
+            sid = student["_id"]
+            if(sid not in seen):
+                seen.add(sid)
+                students.append(student)
+                partial[sid] = {"student": student, "perfs": []}
+            perfs.append(perf)
+
+            # Semesters for the summary and the change collections
+            acc = partial.get(sid)
+            if(acc is not None):
+                acc["perfs"].append(perf)
+                if(len(acc["perfs"]) == NUMSEMESTERS): # All semesters read -> the student's summary and changes are final
+                    summary = summaryDocument(sid, acc["perfs"])
+                    summaries.append(summary)
+                    for subj in SUBJECTS:
+                        doc = changeDocument(acc["student"], summary["pre"]["avg"].get(subj), summary["post"]["avg"].get(subj))
+                        if(doc is not None): # No percent change with a pre average of 0
+                            changes[subj].append(doc)
+                    del partial[sid]
+
+            if(len(perfs) >= batchSize):
+                if(students): # Every student of this batch may have been flushed already
+                    writer.insert("students", students)
+                if(perfs):
+                    writer.insert("performances", perfs)
+                students, perfs = [], []
+            if(len(summaries) >= batchSize):
+                writer.replace("summaries", summaries)
+                for subj in SUBJECTS:
+                    if(changes[subj]):
+                        writer.replace(subj, changes[subj])
+                summaries = []
+                changes = {subj: [] for subj in SUBJECTS}
+
+    # Last partial batches
+    if(students):
+        writer.insert("students", students)
+    if(perfs):
+        writer.insert("performances", perfs)
+    if(summaries):
+        writer.replace("summaries", summaries)
+        for subj in SUBJECTS:
+            if(changes[subj]):
+                writer.replace(subj, changes[subj])
+    writer.close()
+    written = lambda name: writer.written.get(name, {"inserted": 0, "upserted": 0, "modified": 0})
+    counts = {"students": written("students")["inserted"], "performances": written("performances")["inserted"], "duplicates": writer.duplicates}
+    counts["summaries"] = {"upserted": written("summaries")["upserted"], "modified": written("summaries")["modified"]}
+    counts["incomplete"] = len(partial) # Students without all semesters have no summary or change documents
+
+    end = endPerformanceWrite(db, version)
+    if(not counts["incomplete"] and not counts["duplicates"]): # Every loaded student has their summary, from all of their semesters
+        endSummaryWrite(db, version, end)
+    bumpVersion(db, ["students", "summaries", "accumulators"] + SUBJECTS)
+    refreshEmbedded(db) # A database migrated to semesters gets the new grades too
+    ensureIndexes(db)
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description="Load the COVID-19 grades CSV into students, performances and the subject collections")
+    parser.add_argument("csv", help="path to the CSV file")
+    parser.add_argument("--uri", default=MONGO_URI)
+    parser.add_argument("--db", default="covid19stud")
+    parser.add_argument("--drop", action="store_true", help="drop the existing collections first (a reload)")
+    parser.add_argument("--workers", type=int, default=0, help="writer threads")
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE)
+    args = parser.parse_args()
+
+    db = MongoClient(args.uri)[args.db]
+    if(args.drop):
+        for name in ["students", "performances"] + SUBJECTS:
+            db[name].drop()
+        resetAccumulators(db)
+        resetSummaries(db)
+    counts = ingestCsv(db, args.csv, args.workers, args.batch_size)
+    print("Loaded", counts["students"], "students and", counts["performances"], "performances")
+    print("Summaries/change documents per subject:", counts["summaries"]["upserted"], "new,", counts["summaries"]["modified"], "updated")
+    if(counts["duplicates"]):
+        print(counts["duplicates"], "documents were already loaded and were skipped")
+    if(counts["incomplete"]):
+        print(counts["incomplete"], "students don't have all", NUMSEMESTERS, "semesters and have no summary or change documents")
+
+# Execute main
+if __name__ == "__main__":
+    main()
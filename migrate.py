@@ -0,0 +1,97 @@
+import argparse
+
+from pymongo import MongoClient, ReplaceOne
+
+from project3 import MONGO_URI, SUBJECTS, NUMSEMESTERS, SCAN_BATCH_SIZE, REBUILD_BATCH_SIZE, bumpVersion, detectLayout, semesterDocument
+
+# Copies performances (one document per student and semester) into semesters (one document per student)
+# -> One aggregation grouping every student's semesters, written with batched upserts (idempotent, so it can be re-run)
+# -> performances is left as it is, so the reports can still read it (--layout rows)
+# Input: db -> main database
+# Returns the number of students written
+def migrateToEmbedded(db):
+    semester = {"time_period": "$time_period"}
+    for subj in SUBJECTS:
+        semester[subj] = "$" + subj
+    pipeline = [{"$group": {"_id": "$sid", "performances": {"$push": semester}}}]
+    batch = []
+    written = 0
+    for sr in db.performances.aggregate(pipeline, allowDiskUse=True, batchSize=SCAN_BATCH_SIZE):
+        batch.append(ReplaceOne({"_id": sr["_id"]}, semesterDocument(sr["_id"], sr["performances"]), upsert=True))
+        written += 1
+        if(len(batch) == REBUILD_BATCH_SIZE):
+            db.semesters.bulk_write(batch, ordered=False)
+            batch = []
+    if(batch):
+        db.semesters.bulk_write(batch, ordered=False)
+    bumpVersion(db, ["semesters"])
+    return written
+
+# Rebuilds semesters after a loader wrote performances, if the reports read it (--layout auto)
+# -> Dropped first, so students no longer in performances don't stay behind
+# Input: db -> main database
+# Returns True if semesters was rebuilt
+def refreshEmbedded(db):
+    if(detectLayout(db) != "embedded"):
+        return False
+    db.semesters.drop()
+    migrateToEmbedded(db)
+    return True
+
+# Checks that semesters holds the same grades as performances
+# -> Compares the number of students and of semesters, then every grade of a sample of students
+# Input
+#   1) db: main database
+#   2) sample: number of students to compare grade by grade
+# Returns a list of problems (empty if the layouts match)
+def verifyMigration(db, sample=100):
+    problems = []
+    students = len(db.performances.distinct("sid"))
+    if(db.semesters.count_documents({}) != students):
+        problems.append("performances has " + str(students) + " students, semesters has " + str(db.semesters.count_documents({})))
+    semesterCount = 0
+    for doc in db.semesters.find({}, {"grades": 1}, batch_size=SCAN_BATCH_SIZE):
+        semesterCount += sum(1 for grades in doc["grades"] if grades is not None)
+    if(semesterCount != db.performances.count_documents({})):
+        problems.append("performances has " + str(db.performances.count_documents({})) + " semesters, semesters has " + str(semesterCount))
+    for doc in db.semesters.aggregate([{"$sample": {"size": sample}}]):
+        expected = semesterDocument(doc["_id"], db.performances.find({"sid": doc["_id"]}))
+        if(expected["grades"] != doc["grades"]):
+            problems.append("student " + str(doc["_id"]) + " has different grades")
+    return problems
+
+# Saves which layout the reports read when started with --layout auto
+# Input
+#   1) db: main database
+#   2) layout: "rows" or "embedded"
+def setLayout(db, layout):
+    db.meta.update_one({"_id": "layout"}, {"$set": {"performances": layout, "done": True}}, upsert=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate the grades to the embedded layout (one document per student with " + str(NUMSEMESTERS) + " semester grade vectors)")
+    parser.add_argument("--uri", default=MONGO_URI)
+    parser.add_argument("--db", default="covid19stud")
+    parser.add_argument("--verify-only", action="store_true", help="only compare semesters with performances")
+    parser.add_argument("--rollback", action="store_true", help="switch the reports back to performances (semesters is kept)")
+    args = parser.parse_args()
+
+    db = MongoClient(args.uri)[args.db]
+    if(args.rollback):
+        setLayout(db, "rows")
+        print("The reports read performances again")
+        return
+    if(not args.verify_only):
+        written = migrateToEmbedded(db)
+        print("Wrote", written, "students to semesters")
+    problems = verifyMigration(db)
+    if(problems):
+        for problem in problems:
+            print(problem)
+        print("Not switching the layout")
+        return
+    setLayout(db, "embedded")
+    print("semesters matches performances, the reports now read semesters (--layout auto)")
+
+# Execute main
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import contextlib
+import contextvars
+import json
+import time
+
+import bson
+from pymongo import monitoring
+
+#constants
+EXPLAIN_COMMANDS = ["find", "aggregate", "count"] # Commands that can be re-run with explain
+IGNORED_FIELDS = ["lsid", "$db", "$clusterTime", "$readPreference", "txnNumber", "cursor"] # Driver fields removed before explaining a command
+
+CURRENT_REPORT = contextvars.ContextVar("report", default="(other)") # Report the current database calls belong to
+ACTIVE_PROFILER = None # The QueryProfiler registered on the client, if profiling
+INPUT_WAIT = [0.0] # Total seconds spent waiting for the user at readInput()
+
+# Records every command the client sends, grouped by the report that sent it
+# -> Registered on the MongoClient (event_listeners), so every find/aggregate/getMore/count is seen without changing the reports
+# Per report and command: round trips, time waiting on the database, documents returned (and reply bytes with explain)
+class QueryProfiler(monitoring.CommandListener):
+    def __init__(self, explain=False):
+        global ACTIVE_PROFILER
+        self.explain = explain
+        self.pending = {} # request_id -> (report, command name)
+        self.reports = {} # report -> {"wall", "calls", "commands": {name: stats}}
+        self.commands = [] # (report, database, command) kept for explain
+        ACTIVE_PROFILER = self
+
+    def reportStats(self, report):
+        return self.reports.setdefault(report, {"wall": 0.0, "childWall": 0.0, "calls": 0, "commands": {}})
+
+    def started(self, event):
+        report = CURRENT_REPORT.get()
+        self.pending[event.request_id] = (report, event.command_name)
+        if(self.explain and event.command_name in EXPLAIN_COMMANDS and report != "(explain)"):
+            cmd = {k: v for k, v in event.command.items() if k not in IGNORED_FIELDS}
+            self.commands.append((report, event.database_name, cmd))
+
+    def succeeded(self, event):
+        report, name = self.pending.pop(event.request_id, (CURRENT_REPORT.get(), event.command_name))
+        stats = self.reportStats(report)["commands"].setdefault(name, {"roundTrips": 0, "time": 0.0, "docs": 0, "bytes": 0, "failures": 0})
+        stats["roundTrips"] += 1
+        stats["time"] += event.duration_micros / 1000000
+        stats["docs"] += replyDocCount(event.reply)
+        if(self.explain): # Encoding every reply again costs time, only measured with explain
+            stats["bytes"] += len(bson.encode(event.reply))
+
+    def failed(self, event):
+        report, name = self.pending.pop(event.request_id, (CURRENT_REPORT.get(), event.command_name))
+        stats = self.reportStats(report)["commands"].setdefault(name, {"roundTrips": 0, "time": 0.0, "docs": 0, "bytes": 0, "failures": 0})
+        stats["roundTrips"] += 1
+        stats["failures"] += 1
+        stats["time"] += event.duration_micros / 1000000
+
+    # Re-runs the recorded find/aggregate/count commands with explain("executionStats")
+    # Input: client -> the MongoClient (its commands are not recorded while explaining)
+    def explainAll(self, client):
+        explained = {}
+        with profileReport("(explain)"):
+            for report, dbName, cmd in self.commands:
+                key = (report, repr(cmd))
+                if(key in explained):
+                    continue
+                try:
+                    res = client[dbName].command("explain", cmd, verbosity="executionStats")
+                    explained[key] = {"report": report, "command": next(iter(cmd)), "executionStats": findExecutionStats(res)}
+                except Exception as e: # Some commands can't be explained (ex: old servers) -> note it and keep going
+                    explained[key] = {"report": report, "command": next(iter(cmd)), "error": str(e)}
+        self.reports.pop("(explain)", None)
+        return list(explained.values())
+
+    # Returns the per-report breakdown (dict)
+    def summary(self):
+        res = {}
+        for report, stats in self.reports.items():
+            dbTime = sum(c["time"] for c in stats["commands"].values())
+            res[report] = {
+                "wall": stats["wall"],
+                "calls": stats["calls"],
+                "dbTime": dbTime,
+                "pythonTime": max(0.0, stats["wall"] - stats["childWall"] - dbTime), # Time not spent waiting on the database or in nested reports
+                "roundTrips": sum(c["roundTrips"] for c in stats["commands"].values()),
+                "docs": sum(c["docs"] for c in stats["commands"].values()),
+                "bytes": sum(c["bytes"] for c in stats["commands"].values()),
+                "commands": stats["commands"]
+            }
+        return res
+
+    # Prints the breakdown and writes it (plus explain results) to a JSON file
+    # Input
+    #   1) path: file to write
+    #   2) client: the MongoClient, needed for explain
+    def writeReport(self, path, client=None):
+        out = {"reports": self.summary()}
+        if(self.explain and client is not None):
+            out["explain"] = self.explainAll(client)
+        print("\nProfile (per report)")
+        for report, stats in out["reports"].items():
+            print("  " + report + ":", stats["calls"], "run(s),", round(stats["wall"] * 1000, 2), "ms total,", round(stats["dbTime"] * 1000, 2), "ms database,", round(stats["pythonTime"] * 1000, 2), "ms Python")
+            print("\t", stats["roundTrips"], "round trips,", stats["docs"], "documents")
+            if(self.explain):
+                print("\t", round(stats["bytes"] / 1024, 1), "KB of replies")
+            for name, c in stats["commands"].items():
+                print("\t  " + name + ":", c["roundTrips"], "x,", round(c["time"] * 1000, 2), "ms,", c["docs"], "docs")
+        with open(path, "w") as f:
+            json.dump(out, f, indent=2, default=str)
+        print("Profile written to", path)
+
+# Number of documents in a command reply (cursor batch, or n for count)
+def replyDocCount(reply):
+    cursor = reply.get("cursor")
+    if(cursor is not None):
+        return len(cursor.get("firstBatch", cursor.get("nextBatch", [])))
+    if("n" in reply):
+        return 1
+    return 0
+
+# Finds the executionStats section in an explain result (it is nested differently for find and aggregate)
+# Returns a dict with the main counters, or None
+def findExecutionStats(res):
+    if(isinstance(res, dict)):
+        if("executionStats" in res):
+            stats = res["executionStats"]
+            return {k: stats.get(k) for k in ["nReturned", "executionTimeMillis", "totalKeysExamined", "totalDocsExamined"]}
+        for value in res.values():
+            found = findExecutionStats(value)
+            if(found is not None):
+                return found
+    elif(isinstance(res, list)):
+        for value in res:
+            found = findExecutionStats(value)
+            if(found is not None):
+                return found
+    return None
+
+# input() for the prompts inside reports -> the time spent waiting for the user is left out of report times
+def readInput(prompt=""):
+    start = time.perf_counter()
+    try:
+        return input(prompt)
+    finally:
+        INPUT_WAIT[0] += time.perf_counter() - start
+
+# Marks the database calls made inside the block as belonging to a report, and times the report
+# -> Nested reports are named parent/child (ex: overallAnalysis/showChangeByX)
+# -> Costs almost nothing when not profiling
+# Input: name (string)
+@contextlib.contextmanager
+def profileReport(name):
+    parent = CURRENT_REPORT.get()
+    if(parent not in ("(other)", "(explain)")):
+        name = parent + "/" + name
+    token = CURRENT_REPORT.set(name)
+    start = time.perf_counter()
+    startWait = INPUT_WAIT[0]
+    try:
+        yield
+    finally:
+        CURRENT_REPORT.reset(token)
+        if(ACTIVE_PROFILER is not None):
+            elapsed = time.perf_counter() - start - (INPUT_WAIT[0] - startWait)
+            stats = ACTIVE_PROFILER.reportStats(name)
+            stats["wall"] += elapsed
+            stats["calls"] += 1
+            if(parent != "(other)"):
+                ACTIVE_PROFILER.reportStats(parent)["childWall"] += elapsed
@@ -1,68 +1,370 @@
-from pymongo import MongoClient
+import argparse
+import bisect
+import math
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pymongo import ASCENDING, DeleteOne, MongoClient, ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import OperationFailure
+from profiler import QueryProfiler, profileReport, readInput
+from sketch import KLLSketch
 
 #constants (Includes: number of students and database -> user output conversions)
-NUMSTUDENTS = 1400
+MONGO_URI = "mongodb://localhost:27017"
+NUMSTUDENTS = 1400 # Number of students (set from the students collection at startup)
+SUBJECTS = ["reading", "writing", "math", "readingSL", "writingSL", "mathSL"]
+PERIODS = ["pre", "post"]
+NUMSEMESTERS = 6
+COVIDSEMESTER = 3 # First post-COVID semester (semesters 0 - 2 are pre, 3 - 5 are post)
+PERIOD_WINDOWS = {"pre": (0, COVIDSEMESTER - 1), "post": (COVIDSEMESTER, NUMSEMESTERS - 1)} # The pre/post split as windows of semesters (first, last)
+STATS_MODE = "accumulators" # "accumulators" -> running totals kept on write, "server" -> $group pipeline in MongoDB, "python" -> one-pass scan in Python, "parallel" -> partitioned scan in worker processes, "summaries" -> totals of the per-student summaries
+SCAN_WORKERS = 4 # Worker processes for the "parallel" mode
+PARTITIONS_PER_WORKER = 4 # More partitions than workers so a slow partition doesn't hold up the rest
+CHANGE_FIELDS = ["school", "gender", "household_income", "freelunch", "num_computers", "family_size", "father_educ", "mother_educ"] # Student fields copied into the subject collections
+PERFORMANCE_INDEXES = [[("sid", ASCENDING), ("time_period", ASCENDING)], [("time_period", ASCENDING)]] # Indexes created on performances at startup
+PROFILE_BATCH_SIZE = 100 # Students per batch when streaming student profiles
+REPORT_CACHE_SIZE = 128 # Most report results kept in memory
+VERSION_TTL = 1.0 # Seconds a collectionVersion result is reused before MongoDB is asked again (writes from this process clear it at once)
+REBUILD_BATCH_SIZE = 500 # Students written per batch when rebuilding the subject collections
+CHANGE_CRITERIA = ["family_size", "household_income", "freelunch", "father_educ", "mother_educ", "num_computers"] # Criteria the subject collections can be grouped on
+CHANGE_EDGES = [0, 10, 20, 30, 40, 50, 60] # Percent change groups (a change <= edge falls in that group)
+CHANGE_LABELS = ["increased", "decreased by 0 - 9%", "decreased by 10 - 19%", "decreased by 20 - 29%", "decreased by 30 - 39%", "decreased by 40 - 49%", "decreased by 50 - 59%", "decreased by >= 60%"]
+INCOME_EDGES = [50000, 60000, 70000, 80000, 90000, 100000] # Household income ranges (an income <= edge falls in that range)
+INCOME_LABELS = ["<50000", "50000 - 59999", "60000 - 69999", "70000 - 79999", "80000 - 89999", "90000 - 99999", ">100000"]
+CHANGE_BUCKETS = {"field": "change", "idField": "changeBucket", "edges": CHANGE_EDGES, "labels": CHANGE_LABELS}
+INCOME_BUCKETS = {"field": "household_income", "idField": "incomeBucket", "edges": INCOME_EDGES, "labels": INCOME_LABELS}
+QUANTILES = [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9] # Percentiles shown by the quantile reports (the deciles by default)
+SCAN_BATCH_SIZE = 1000 # Documents per getMore when streaming a collection into Python
+PERF_FIELDS = ["time_period"] + SUBJECTS # Performance fields the statistics scans read
+BITMAP_INDEX = False # Count the demographics from the in-process bitmap index (bitmap.py) instead of grouping students in MongoDB
+PERF_LAYOUT = "rows" # "rows" -> performances (one document per student and semester), "embedded" -> semesters (one document per student, see migrate.py)
 EDUCATION = {0 : "No HS Diploma", 1 : "HS Diploma", 2: "BS", 3: "MS", 4 : "PhD"}
 SCHOOL = {True: "School: B (Poor)", False: "School: A (Wealthy)"}
 GENDER = {True: "Gender: Female", False: "Gender: Male"}
 COVIDPOS = {True: "Has had COVID", False: "Has never had COVID"}
 FREELUNCH = {True: "Free or Reduced Lunch: Yes", False: "Free or Reduced Lunch: No"}
 
-# Final step in finding the average of a list
-# -> Divides the added total by the number of semesters
-# Input: 
-#   1) values: a list of tuples (int) - (pre-COVID avg for a subject, post-COVID avg for a subject)
-#   2) numSem: the number of semesters (int)
-# Returns a new list with the final averages 
-def calcDivAvgList(values, numSem):
-    avg = []
-    for x in values:
-        avg.append((x[0]/numSem, x[1]/numSem))
-    return avg
-
-# Finds the average
-def avg(x,y):
-    return (x + y)/2
-
-# Finds the square root using approximation
-# Input 
-#   1) n: The original number
-#   2) Guess: A guess
-#   3) nearEnough: Margin of error
-# Returns the square root
-def sqrtAppr(n, guess, nearEnough):
-    if(abs(((guess*guess) - n)) < nearEnough):
-        return guess
+# Streaming accumulator for count, mean and variance (Welford's method)
+# -> Numerically stable, so it can run over the whole population in one pass
+# -> Two accumulators can be merged (Chan et al.), so partial scans can be combined
+class RunningStats:
+    def __init__(self, count=0, total=0, mean=0.0, m2=0.0):
+        self.count = count
+        self.total = total # Exact sum (grades are ints)
+        self.mean = mean
+        self.m2 = m2 # Sum of squared differences from the current mean
+
+    # Adds one value to the accumulator
+    def add(self, x):
+        self.count += 1
+        self.total += x
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+
+    # Combines another accumulator into this one
+    def merge(self, other):
+        if(other.count == 0):
+            return self
+        total = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / total
+        self.m2 += other.m2 + (delta ** 2) * self.count * other.count / total
+        self.count = total
+        self.total += other.total
+        return self
+
+    # Population variance (same as the original calculation: divide by the number of values)
+    def variance(self):
+        if(self.count == 0):
+            return 0.0
+        return self.m2 / self.count
+
+    def stddev(self):
+        return math.sqrt(self.variance())
+
+    # Returns a dict with the final statistics
+    def result(self):
+        return {"count": self.count, "sum": self.total, "mean": self.mean, "variance": self.variance(), "stddev": self.stddev()}
+
+# Opens a cursor for a full scan that only sends back the fields it needs
+# -> Projection (no _id or unused fields), larger batches (fewer getMore round trips)
+# Input
+#   1) collection: the collection
+#   2) query: filter (dict)
+#   3) fields: list of fields to send back
+# Returns the cursor
+def scanCursor(collection, query, fields):
+    projection = {"_id": 0}
+    for field in fields:
+        projection[field] = 1
+    return collection.find(query, projection, batch_size=SCAN_BATCH_SIZE)
+
+# Finds which layout the grades were last migrated to (saved in db.meta by migrate.py)
+# Input: db -> main database
+# Returns "rows" or "embedded"
+def detectLayout(db):
+    layout = db.meta.find_one({"_id": "layout"})
+    if(layout is not None and layout.get("done")):
+        return layout["performances"]
+    return "rows"
+
+# Collection that holds the grades in the current layout (performances or semesters)
+# Input
+#   1) db: main database
+#   2) layout: "rows" or "embedded" (defaults to PERF_LAYOUT)
+def perfCollection(db, layout=None):
+    if(layout is None):
+        layout = PERF_LAYOUT
+    if(layout == "embedded"):
+        return db.semesters
+    return db.performances
+
+# Builds a student's document for the embedded layout -> one grade vector per semester, in SUBJECTS order
+# Input
+#   1) sid: student id (int)
+#   2) perfs: the student's performance documents
+# Returns {"_id": sid, "grades": list of NUMSEMESTERS vectors (None for a semester with no grades)}
+def semesterDocument(sid, perfs):
+    grades = [None] * NUMSEMESTERS
+    for perf in perfs:
+        grades[perf["time_period"]] = [perf[subj] for subj in SUBJECTS]
+    return {"_id": sid, "grades": grades}
+
+# Turns an embedded layout document back into performance documents (sorted by time_period)
+# Input: doc -> {"_id": sid, "grades": [...]}
+# Returns a list of {"sid", "time_period", subject: grade}
+def expandSemesters(doc):
+    perfs = []
+    for timePeriod, grades in enumerate(doc["grades"]):
+        if(grades is not None):
+            perf = {"sid": doc["_id"], "time_period": timePeriod}
+            for i, subj in enumerate(SUBJECTS):
+                perf[subj] = grades[i]
+            perfs.append(perf)
+    return perfs
+
+# Streams every performance (sid, time_period and the six subjects) from either layout
+# Input
+#   1) db: main database
+#   2) lo, hi: only students in the sid range [lo, hi) (optional)
+#   3) layout: "rows" or "embedded" (defaults to PERF_LAYOUT)
+# Returns a generator of performance documents
+def scanPerformances(db, lo=None, hi=None, layout=None):
+    if(layout is None):
+        layout = PERF_LAYOUT
+    field = "_id" if layout == "embedded" else "sid"
+    query = {} if lo is None else {field: {"$gte": lo, "$lt": hi}}
+    if(layout == "embedded"):
+        for doc in scanCursor(db.semesters, query, ["_id", "grades"]):
+            yield from expandSemesters(doc)
     else:
-        return sqrtAppr(n, avg((n/guess), guess), nearEnough)
+        yield from scanCursor(db.performances, query, ["sid"] + PERF_FIELDS)
+
+# Reads one student's performances from either layout
+# Input
+#   1) db: main database
+#   2) sid: student id (int)
+# Returns a list of performance documents sorted by time_period
+def readPerformances(db, sid):
+    if(PERF_LAYOUT == "embedded"):
+        doc = db.semesters.find_one({"_id": sid})
+        return expandSemesters(doc) if doc is not None else []
+    return list(db.performances.find({"sid": sid}, {"_id": 0}).sort("time_period", 1))
 
-# Uses Newton's Method to find the standard deviation
+# Finds whether a semester is pre-COVID or post-COVID
+# Input: time_period (int), semesters 0 - 2 are pre-COVID and 3 - 5 are post-COVID
+# Returns "pre" or "post"
+def periodOf(timePeriod):
+    if(timePeriod < COVIDSEMESTER):
+        return "pre"
+    return "post"
+
+# Running totals of a student's grades by semester -> the total of any window of semesters is 2 lookups
+# Input: perfs -> the student's performance documents
+# Returns a dict -> {"count": list, subject: list}, entry t is the number of semesters (or the total of the subject's grades)
+#   with time_period < t, for t = 0 ... NUMSEMESTERS
+def prefixSums(perfs):
+    bySemester = {perf["time_period"]: perf for perf in perfs}
+    prefix = {"count": [0]}
+    for subj in SUBJECTS:
+        prefix[subj] = [0]
+    for t in range(NUMSEMESTERS):
+        perf = bySemester.get(t)
+        prefix["count"].append(prefix["count"][-1] + (perf is not None))
+        for subj in SUBJECTS:
+            prefix[subj].append(prefix[subj][-1] + (perf[subj] if perf is not None else 0))
+    return prefix
+
+# Average of every subject over a window of semesters, from the prefix sums
+# Input
+#   1) prefix: from prefixSums
+#   2) window: (first, last) time_period, both included
+# Returns {subject: average}, or None if there are no grades in the window
+def windowAverages(prefix, window):
+    first, last = window
+    count = prefix["count"][last + 1] - prefix["count"][first]
+    if(count == 0):
+        return None
+    return {subj: (prefix[subj][last + 1] - prefix[subj][first]) / count for subj in SUBJECTS}
+
+# Reads a window of semesters, ex: "0-2" -> (0, 2), "4" -> (4, 4)
+# Raises ValueError if it isn't a range of semesters between 0 and NUMSEMESTERS - 1
+def parseWindow(text):
+    first, _, last = text.partition("-")
+    window = (int(first), int(last or first))
+    if(window[0] < 0 or window[0] > window[1] or window[1] >= NUMSEMESTERS):
+        raise ValueError("A window is 'first-last' with semesters between 0 and " + str(NUMSEMESTERS - 1))
+    return window
+
+# Finds the count, mean, variance and standard deviation of every subject pre and post COVID
+# -> Reads the performances collection once (replaces the sums loop + 2 standard deviation scans)
 # Input
 #   1) performances: The performances collection
-#   2) avgList: A list of averages/mean
-#   3) sem: The number of semesters
-#  Returns a final array of the standard deviations for each subject
-def calcStandardDeviation(performances, avgList, sem):
-    #Check if semester is 0 (pre) or 1 (post)
-    if(sem == 0): # Query: Find the performances for semesters 0 - 2 (pre)
-        stmt = {"time_period":{"$lt" : 3}}
-    else: # Query: Find the performances for semesters 3 - 5 (post)
-        stmt = {"time_period":{"$gt" : 3}}
-        
-    performanceRes = performances.find(stmt)
-    readingTotal = writingTotal = mathTotal = readingSLTotal = writingSLTotal = mathSLTotal = 0
-    # Squares the difference between the reading score and the mean
-    for perf in performanceRes:
-        readingTotal += ((perf["reading"] - avgList[0]) ** 2)
-        writingTotal += ((perf["writing"] - avgList[1]) ** 2)
-        mathTotal += ((perf["math"] - avgList[2]) ** 2)
-        readingSLTotal += ((perf["readingSL"] - avgList[3]) ** 2)
-        writingSLTotal += ((perf["writingSL"] - avgList[4]) ** 2)
-        mathSLTotal += ((perf["mathSL"] - avgList[5]) ** 2)
-
-    numSem = 3 * NUMSTUDENTS #pre or post is only 3 semesters
-    allStdDev = [sqrtAppr((readingTotal/numSem), 1, 0.001), sqrtAppr((writingTotal/numSem), 1, 0.001), sqrtAppr((mathTotal/numSem), 1, 0.001), sqrtAppr((readingSLTotal/numSem), 1, 0.001), sqrtAppr((writingSLTotal/numSem), 1, 0.001), sqrtAppr((mathSLTotal/numSem), 1, 0.001)]
-    return allStdDev
+# Returns a dict -> {"pre": {subject: stats}, "post": {subject: stats}}
+#   where stats is {"count", "sum", "mean", "variance", "stddev"}
+def calcPeriodStats(performances):
+    acc = {period: {subj: RunningStats() for subj in SUBJECTS} for period in PERIODS}
+    for perf in scanPerformances(performances.database):
+        periodAcc = acc[periodOf(perf["time_period"])]
+        for subj in SUBJECTS:
+            periodAcc[subj].add(perf[subj])
+    return {period: {subj: acc[period][subj].result() for subj in SUBJECTS} for period in PERIODS}
+
+# Scans one sid range of performances (runs in a worker process with its own client)
+# Input
+#   1) uri: MongoDB connection string
+#   2) dbName: database name
+#   3) lo, hi: the sid range [lo, hi)
+#   4) layout: "rows" or "embedded" (passed in because worker processes don't see main's settings)
+# Returns {period: {subject: (count, total, mean, m2)}} -> the partial RunningStats
+def scanPartition(uri, dbName, lo, hi, layout="rows"):
+    client = MongoClient(uri)
+    acc = {period: {subj: RunningStats() for subj in SUBJECTS} for period in PERIODS}
+    for perf in scanPerformances(client[dbName], lo, hi, layout):
+        periodAcc = acc[periodOf(perf["time_period"])]
+        for subj in SUBJECTS:
+            periodAcc[subj].add(perf[subj])
+    client.close()
+    return {period: {subj: (s.count, s.total, s.mean, s.m2) for subj, s in acc[period].items()} for period in PERIODS}
+
+# Splits the sids in performances into ranges
+# Input
+#   1) performances: The performances collection
+#   2) parts: number of ranges (int)
+# Returns a list of (lo, hi) sid ranges, hi not included
+def sidPartitions(performances, parts):
+    col, field = (performances.database.semesters, "_id") if PERF_LAYOUT == "embedded" else (performances, "sid")
+    first = col.find_one({}, {field: 1}, sort=[(field, ASCENDING)])
+    last = col.find_one({}, {field: 1}, sort=[(field, -1)])
+    if(first is None):
+        return []
+    lo, hi = first[field], last[field] + 1
+    step = max(1, math.ceil((hi - lo) / parts))
+    return [(start, min(start + step, hi)) for start in range(lo, hi, step)]
+
+# Finds the same statistics as calcPeriodStats by scanning sid ranges in parallel worker processes
+# -> Each worker returns partial counts/means/sums of squares, which are merged (RunningStats.merge)
+# Input
+#   1) performances: The performances collection
+#   2) uri: MongoDB connection string for the workers
+#   3) workers: number of worker processes
+# Returns a dict -> {"pre": {subject: stats}, "post": {subject: stats}}
+def parallelPeriodStats(performances, uri=MONGO_URI, workers=SCAN_WORKERS):
+    acc = {period: {subj: RunningStats() for subj in SUBJECTS} for period in PERIODS}
+    ranges = sidPartitions(performances, workers * PARTITIONS_PER_WORKER)
+    dbName = performances.database.name
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(scanPartition, uri, dbName, lo, hi, PERF_LAYOUT) for lo, hi in ranges]
+        for future in futures:
+            partial = future.result()
+            for period in PERIODS:
+                for subj in SUBJECTS:
+                    acc[period][subj].merge(RunningStats(*partial[period][subj]))
+    return {period: {subj: acc[period][subj].result() for subj in SUBJECTS} for period in PERIODS}
+
+# Builds the $group stage for aggregatePeriodStats (count, sum, average and standard deviation of every subject)
+# Input: groupId -> what to group on (expression)
+def periodStatsGroup(groupId):
+    group = {"_id": groupId, "count": {"$sum": 1}}
+    for subj in SUBJECTS:
+        group[subj + "_sum"] = {"$sum": "$" + subj}
+        group[subj + "_avg"] = {"$avg": "$" + subj}
+        group[subj + "_std"] = {"$stdDevPop": "$" + subj}
+    return group
+
+# Builds the pipeline for the pre/post statistics on the current layout
+# -> The embedded layout is unwound first (array position -> time_period, vector -> subject fields)
+# Input
+#   1) groupId: what to group on (expression)
+#   2) match: filter on time_period (dict, optional)
+# Returns the pipeline (run it on perfCollection)
+def periodStatsPipeline(groupId, match=None):
+    pipeline = []
+    if(PERF_LAYOUT == "embedded"):
+        project = {"time_period": 1}
+        for i, subj in enumerate(SUBJECTS):
+            project[subj] = {"$arrayElemAt": ["$grades", i]}
+        pipeline += [
+            {"$unwind": {"path": "$grades", "includeArrayIndex": "time_period"}},
+            {"$match": {"grades": {"$ne": None}}},
+            {"$project": project}
+        ]
+    if(match is not None):
+        pipeline.append({"$match": match})
+    pipeline.append({"$group": periodStatsGroup(groupId)})
+    return pipeline
+
+# Converts the grouped documents ({"_id": "pre" or "post", ...}) into the statistics dict
+# Input: periodRes -> the grouped documents
+# Returns a dict -> {"pre": {subject: stats}, "post": {subject: stats}}
+def periodStatsFromGroups(periodRes):
+    stats = {period: {subj: RunningStats().result() for subj in SUBJECTS} for period in PERIODS}
+    for pr in periodRes:
+        for subj in SUBJECTS:
+            std = pr[subj + "_std"] or 0.0
+            stats[pr["_id"]][subj] = {"count": pr["count"], "sum": pr[subj + "_sum"], "mean": pr[subj + "_avg"], "variance": std ** 2, "stddev": std}
+    return stats
+
+# Finds the same statistics as calcPeriodStats, but inside MongoDB with a $group pipeline
+# -> Only 2 documents (pre and post) are sent back instead of every performance
+# Input
+#   1) performances: The performances collection
+# Returns a dict -> {"pre": {subject: stats}, "post": {subject: stats}}
+def aggregatePeriodStats(performances):
+    pipeline = periodStatsPipeline({"$cond": [{"$lt": ["$time_period", COVIDSEMESTER]}, "pre", "post"]})
+    return periodStatsFromGroups(perfCollection(performances.database).aggregate(pipeline))
+
+# Gets the pre and post statistics for every subject
+# -> Reads the accumulators by default, the $group pipeline is used if they (or the summaries) are out of date and the Python scan is only a fallback
+# Input
+#   1) performances: The performances collection
+#   2) mode: "accumulators", "server", "python", "parallel" or "summaries" (defaults to STATS_MODE)
+# Returns a dict -> {"pre": {subject: stats}, "post": {subject: stats}}
+def getPeriodStats(performances, mode=None):
+    if(mode is None):
+        mode = STATS_MODE
+    if(mode == "accumulators"):
+        stats = accumulatorPeriodStats(performances.database)
+        if(stats is not None):
+            return stats
+        print("The accumulators don't match performances (run --rebuild-accumulators), using the $group pipeline instead")
+        mode = "server"
+    elif(mode == "summaries"):
+        stats = summaryPeriodStats(performances.database.summaries)
+        if(stats is not None):
+            return stats
+        print("The summaries don't match performances (run --rebuild-summaries), using the $group pipeline instead")
+        mode = "server"
+    if(mode == "server"):
+        try:
+            return aggregatePeriodStats(performances)
+        except OperationFailure as e: # Server can't run the pipeline (ex: old version) -> scan in Python
+            print("Aggregation failed (" + str(e) + "), using the Python scan instead")
+    elif(mode == "parallel"):
+        return parallelPeriodStats(performances, MONGO_URI, SCAN_WORKERS)
+    return calcPeriodStats(performances)
 
 # Finds the percent change for 1 subject
 # Input
@@ -73,30 +375,6 @@ def calcPercentChange(preAvg, postAvg):
     percentageRounded = round(percentage, 2)
     return (percentageRounded)
 
-# Finds the percent change for 1 subject based on the student
-# Input
-#   1) studentPerformance: Cursor to a student's grades
-#   2) subject: The subject (string)
-# Returns the percent change
-def calcPercentChangeBySubject(studentPerformance, subject):
-    i = 0
-    preAvg = postAvg = 0
-    for perf in studentPerformance:
-        if i < 3:
-            preAvg += perf[subject]
-        else:
-            postAvg += perf[subject]
-        i += 1
-
-    # Calculate avg
-    numSem = 3
-    preAvg /= numSem
-    postAvg /= numSem
-
-    # Calculate percent change
-    percentChange = calcPercentChange(preAvg, postAvg)
-    return percentChange
-
 # Finds the percent change for all 6 subjects
 # Input
 #   1) avgList: A list of tuples (int) that contain the pre-COVID average and post-COVID average
@@ -132,22 +410,665 @@ def aggregateStudents(students, criteria):
         ])
     return studentsRes 
 
+# Least recently used cache of report results
+# -> Locked, so reports running on several threads (service.py) can share it
+class ReportCache:
+    def __init__(self, maxSize=REPORT_CACHE_SIZE):
+        self.maxSize = maxSize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    # Returns the cached value, or None if it isn't cached
+    def get(self, key):
+        with self.lock:
+            if(key not in self.entries):
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while(len(self.entries) > self.maxSize):
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+REPORT_CACHE = ReportCache()
+VERSION_CACHE = {} # (client, database, collection names) -> (time read, collectionVersion result)
+VERSION_LOCK = threading.Lock()
+
+# Marks collections as changed so cached reports that read them are not reused
+# -> Every write in this program calls it (ingest, datagen and migrate go through it too)
+# -> Writers outside these modules (mongoimport, the shell, another program) must call it as well, or $inc the counters in meta {_id: "versions"}:
+#    without it an update in place is never noticed, the UUID and the document count only catch reloads, inserts and deletes
+# Input
+#   1) db: main database
+#   2) names: list of collection names
+def bumpVersion(db, names):
+    db.meta.update_one({"_id": "versions"}, {"$inc": {name: 1 for name in names}}, upsert=True)
+    clearVersionCache()
+
+# bumpVersion for one collection
+# Returns its new change counter
+def nextVersion(db, name):
+    version = db.meta.find_one_and_update({"_id": "versions"}, {"$inc": {name: 1}}, upsert=True, return_document=ReturnDocument.AFTER)[name]
+    clearVersionCache()
+    return version
+
+# Forgets the memoized collection versions, so the next collectionVersion asks MongoDB
+def clearVersionCache():
+    with VERSION_LOCK:
+        VERSION_CACHE.clear()
+
+# Matches a change counter in the versions document (a counter that was never bumped is missing, same as 0)
+def versionFilter(value):
+    if(value == 0):
+        return {"$in": [0, None]}
+    return value
+
+# Identifies the current version of some collections
+# -> Change counter (bumpVersion) + collection UUID (changes when it is dropped and reloaded) + document count
+# -> Memoized for VERSION_TTL seconds, so a burst of cache hits costs one round of reads instead of 2 + one count per collection each
+#    (bumpVersion clears it, a write from another process is seen at most VERSION_TTL seconds late)
+# Input
+#   1) db: main database
+#   2) names: list of collection names
+# Returns a tuple that changes whenever one of the collections changes
+def collectionVersion(db, names):
+    key = (id(db.client), db.name, tuple(names))
+    now = time.monotonic()
+    with VERSION_LOCK:
+        memo = VERSION_CACHE.get(key)
+    if(memo is not None and now - memo[0] < VERSION_TTL):
+        return memo[1]
+    counters = db.meta.find_one({"_id": "versions"}) or {}
+    uuids = {}
+    for info in db.list_collections(filter={"name": {"$in": names}}):
+        uuids[info["name"]] = info.get("info", {}).get("uuid")
+    version = tuple((name, counters.get(name, 0), uuids.get(name), db[name].estimated_document_count()) for name in names)
+    with VERSION_LOCK:
+        VERSION_CACHE[key] = (now, version)
+    return version
+
+# Returns a report result from the cache, or computes and caches it
+# Input
+#   1) db: main database
+#   2) key: tuple identifying the report and its parameters, Ex: ("changeByX", "math", "freelunch")
+#   3) names: list of collection names the report reads
+#   4) compute: function that computes the result
+# Returns the result
+def cachedReport(db, key, names, compute):
+    key = (key, collectionVersion(db, names))
+    res = REPORT_CACHE.get(key)
+    if(res is None):
+        res = compute()
+        REPORT_CACHE.put(key, res)
+    return res
+
+# Finds which bucket a value falls in (same rule as bucketIdExpr: the first edge the value is <= to)
+# Input
+#   1) value: the value (int or float)
+#   2) buckets: bucket definition (ex: CHANGE_BUCKETS)
+# Returns the bucket id (int), 0 to len(edges)
+def bucketOf(value, buckets):
+    return bisect.bisect_left(buckets["edges"], value)
+
+# Builds the expression that gives a document's bucket id
+# -> A $switch with one branch per edge, so the bins are data instead of nested $cond
+# -> Uses the stored bucket id (see storeBucketIds) when the document has one
+# Input
+#   1) buckets: bucket definition (ex: CHANGE_BUCKETS)
+#   2) stored: use the stored id field if it exists (bool)
+# Returns the expression (dict)
+def bucketIdExpr(buckets, stored=True):
+    field = "$" + buckets["field"]
+    branches = [{"case": {"$lte": [field, edge]}, "then": i} for i, edge in enumerate(buckets["edges"])]
+    switch = {"$switch": {"branches": branches, "default": len(buckets["edges"])}}
+    if(stored):
+        return {"$ifNull": ["$" + buckets["idField"], switch]}
+    return switch
+
+# Groups a collection by bucket
+# Input
+#   1) collection: the collection
+#   2) buckets: bucket definition (ex: INCOME_BUCKETS)
+# Returns a list of {"_id": bucket label, "size": number of documents} in bucket order
+def aggregateBuckets(collection, buckets):
+    bucketRes = collection.aggregate([
+        {"$group": {"_id": bucketIdExpr(buckets), "size": {"$count" : { }}}},
+        {"$sort": {"_id": 1}}
+    ])
+    return [{"_id": buckets["labels"][br["_id"]], "size": br["size"]} for br in bucketRes]
+
+# Saves the bucket id on every document of a collection and indexes it
+# -> Grouping then reads an integer field instead of evaluating the $switch for every document
+# Input
+#   1) collection: the collection
+#   2) buckets: bucket definition (ex: CHANGE_BUCKETS)
+# Returns the number of documents updated
+def storeBucketIds(collection, buckets):
+    res = collection.update_many({}, [{"$set": {buckets["idField"]: bucketIdExpr(buckets, stored=False)}}])
+    collection.create_index(buckets["idField"])
+    bumpVersion(collection.database, [collection.name])
+    return res.modified_count
+
+# Raised when a query that should use an index scans the whole collection
+class QueryPlanError(Exception):
+    pass
+
+# Creates the indexes used by the reports (does nothing if they already exist)
+# Input
+#   1) db: main database
+# Returns a list of the index names
+def ensureIndexes(db):
+    names = []
+    for keys in PERFORMANCE_INDEXES:
+        names.append(db.performances.create_index(keys))
+    return names
+
+# Finds every stage name in an explain() plan
+# Input: plan (dict or list) from explain()
+# Returns a list of stage names (string)
+def planStages(plan):
+    stages = []
+    if(isinstance(plan, dict)):
+        if("stage" in plan):
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages += planStages(value)
+    elif(isinstance(plan, list)):
+        for value in plan:
+            stages += planStages(value)
+    return stages
+
+# Checks that the hot queries on performances use an index
+# -> Per-student lookups get slower as performances grows if they fall back to a COLLSCAN
+# Input
+#   1) db: main database
+# Raises QueryPlanError if a query scans the whole collection
+def verifyQueryPlans(db):
+    hotQueries = [
+        ("student lookup", {"sid": 1}, [("time_period", ASCENDING)]), # studentInfo, studentPerfChange
+        ("semester range", {"time_period": {"$lt": COVIDSEMESTER}}, None), # pre/post filters
+        ("student range", {"sid": {"$gt": 0}}, None) # resuming rebuildChangeCollections
+    ]
+    for name, stmt, sort in hotQueries:
+        cursor = db.performances.find(stmt)
+        if(sort is not None):
+            cursor = cursor.sort(sort)
+        plan = cursor.explain()["queryPlanner"]["winningPlan"]
+        if("COLLSCAN" in planStages(plan)):
+            raise QueryPlanError("Query '" + name + "' " + str(stmt) + " scans all of performances: " + str(plan))
+
+# Builds the pipeline that finds every student's pre and post average for each subject
+# -> One document per student, joined with their student info
+# Input
+#   1) afterSid: only include students with a larger sid (int, used to resume)
+#   2) layout: "rows" or "embedded" (defaults to PERF_LAYOUT)
+# Returns the pipeline (list), to run on perfCollection
+def studentChangePipeline(afterSid=0, layout=None):
+    if(layout is None):
+        layout = PERF_LAYOUT
+    join = [
+        {"$sort": {"_id": 1}},
+        {"$lookup": {"from": "students", "localField": "_id", "foreignField": "_id", "as": "student"}},
+        {"$unwind": "$student"}
+    ]
+    if(layout == "embedded"): # Already one document per student -> average the pre and post slices of the array
+        project = {}
+        for i, subj in enumerate(SUBJECTS):
+            for period, start, length in [("pre", 0, COVIDSEMESTER), ("post", COVIDSEMESTER, NUMSEMESTERS - COVIDSEMESTER)]:
+                project[subj + "_" + period] = {"$avg": {"$map": {"input": {"$slice": ["$grades", start, length]}, "as": "g", "in": {"$arrayElemAt": ["$$g", i]}}}}
+        return [{"$match": {"_id": {"$gt": afterSid}}}, {"$project": project}] + join
+    group = {"_id": "$sid"}
+    for subj in SUBJECTS:
+        group[subj + "_pre"] = {"$avg": {"$cond": [{"$lt": ["$time_period", COVIDSEMESTER]}, "$" + subj, None]}}
+        group[subj + "_post"] = {"$avg": {"$cond": [{"$lt": ["$time_period", COVIDSEMESTER]}, None, "$" + subj]}}
+    return [{"$match": {"sid": {"$gt": afterSid}}}, {"$group": group}] + join
+
+# Builds a student's document for a subject collection (reading, writing, ...)
+# Input
+#   1) student: the student document
+#   2) preAvg, postAvg: the student's pre and post COVID averages for the subject
+# Returns the document -> student fields, percent change and bucket ids
+#   (None without pre or post semesters, or with a pre average of 0: there is no percent change)
+def changeDocument(student, preAvg, postAvg):
+    if(not preAvg or postAvg is None):
+        return None
+    doc = {"_id": student["_id"]}
+    for field in CHANGE_FIELDS:
+        doc[field] = student[field]
+    doc["change"] = calcPercentChange(preAvg, postAvg)
+    doc["changeBucket"] = bucketOf(doc["change"], CHANGE_BUCKETS)
+    doc["incomeBucket"] = bucketOf(doc["household_income"], INCOME_BUCKETS)
+    return doc
+
+# Writes one batch of subject documents and saves how far the rebuild got
+# Input
+#   1) db: main database
+#   2) batch: dict -> {subject: list of ReplaceOne}
+#   3) lastSid: the last sid in the batch (int)
+def writeChangeBatch(db, batch, lastSid):
+    for subj in SUBJECTS:
+        if(batch[subj]):
+            db[subj].bulk_write(batch[subj], ordered=False)
+            batch[subj] = []
+    bumpVersion(db, SUBJECTS)
+    db.meta.update_one({"_id": "rebuild_changes"}, {"$set": {"lastSid": lastSid, "done": False}}, upsert=True)
+
+# (Re)builds the subject collections (reading, writing, math, readingSL, writingSL, mathSL) used by showChangeByX
+# -> One aggregation over performances, written with batched upserts (replaces 1 find + 1 find + 1 insert per student per subject)
+# -> Idempotent: every student document is replaced by _id, so running it twice gives the same collections
+# -> Resumable: the last written sid is saved in db.meta, an interrupted rebuild continues from there
+# -> A subject without a percent change (see changeDocument) is skipped and its old document removed
+# Input
+#   1) db: main database
+#   2) restart: ignore the saved progress and rebuild every student (bool)
+# Returns a tuple (students written, students skipped in at least one subject)
+def rebuildChangeCollections(db, restart=False):
+    progress = db.meta.find_one({"_id": "rebuild_changes"})
+    afterSid = 0
+    if(progress is not None and not restart and not progress.get("done")):
+        afterSid = progress["lastSid"]
+        print("Resuming after student", afterSid)
+
+    batch = {subj: [] for subj in SUBJECTS}
+    written = skipped = inBatch = 0
+    lastSid = afterSid
+    for sr in perfCollection(db).aggregate(studentChangePipeline(afterSid), allowDiskUse=True, batchSize=SCAN_BATCH_SIZE):
+        missing = False
+        for subj in SUBJECTS:
+            doc = changeDocument(sr["student"], sr[subj + "_pre"], sr[subj + "_post"])
+            if(doc is None): # No percent change without pre and post grades
+                batch[subj].append(DeleteOne({"_id": sr["_id"]}))
+                missing = True
+            else:
+                batch[subj].append(ReplaceOne({"_id": sr["_id"]}, doc, upsert=True))
+        skipped += missing
+        lastSid = sr["_id"]
+        written += 1
+        inBatch += 1
+        if(inBatch == REBUILD_BATCH_SIZE):
+            writeChangeBatch(db, batch, lastSid)
+            inBatch = 0
+    writeChangeBatch(db, batch, lastSid)
+    db.meta.update_one({"_id": "rebuild_changes"}, {"$set": {"done": True}})
+    return written, skipped
+
+# Builds a student's summary document from their semesters
+# -> Kept in the summaries collection so single-student reports are one read by _id
+# Input
+#   1) sid: student id (int)
+#   2) perfs: the student's performance documents
+# Returns the summary -> "performances": semesters sorted by time_period,
+#   "pre"/"post": {"count", "sum": {subject: total}, "sumsq": {subject: total of squares}, "avg": {subject: average}},
+#   "change": {subject: percent change} (empty without both pre and post semesters, no subject with a pre average of 0),
+#   "prefix": running totals by semester (see prefixSums), so compareWindows can average any window
+def summaryDocument(sid, perfs):
+    perfs = sorted(({k: v for k, v in perf.items() if k not in ("_id", "sid")} for perf in perfs), key=lambda perf: perf["time_period"])
+    summary = {"_id": sid, "performances": perfs, "change": {}, "prefix": prefixSums(perfs)}
+    for period in PERIODS:
+        summary[period] = {"count": 0, "sum": dict.fromkeys(SUBJECTS, 0), "sumsq": dict.fromkeys(SUBJECTS, 0), "avg": {}}
+    for perf in perfs:
+        periodSum = summary[periodOf(perf["time_period"])]
+        periodSum["count"] += 1
+        for subj in SUBJECTS:
+            periodSum["sum"][subj] += perf[subj]
+            periodSum["sumsq"][subj] += perf[subj] ** 2
+    for period in PERIODS:
+        periodSum = summary[period]
+        if(periodSum["count"] > 0):
+            periodSum["avg"] = {subj: periodSum["sum"][subj] / periodSum["count"] for subj in SUBJECTS}
+    if(summary["pre"]["count"] > 0 and summary["post"]["count"] > 0):
+        summary["change"] = {subj: calcPercentChange(summary["pre"]["avg"][subj], summary["post"]["avg"][subj]) for subj in SUBJECTS if summary["pre"]["avg"][subj]}
+    return summary
+
+# (Re)builds the summaries collection from performances
+# -> One aggregation grouping every student's semesters, written with batched upserts (idempotent)
+# -> A full rebuild is marked as matching the performances version read before it, unless a writer changed it meanwhile
+# Input
+#   1) db: main database
+#   2) sids: only rebuild these students (list, optional)
+# Returns the number of summaries written
+def rebuildSummaries(db, sids=None):
+    version = (db.meta.find_one({"_id": "versions"}) or {}).get("performances", 0)
+    if(PERF_LAYOUT == "embedded"): # Already one document per student
+        query = {} if sids is None else {"_id": {"$in": list(sids)}}
+        studentRes = ({"_id": doc["_id"], "performances": expandSemesters(doc)} for doc in db.semesters.find(query, batch_size=SCAN_BATCH_SIZE))
+    else:
+        pipeline = []
+        if(sids is not None):
+            pipeline.append({"$match": {"sid": {"$in": list(sids)}}})
+        pipeline.append({"$group": {"_id": "$sid", "performances": {"$push": "$$ROOT"}}})
+        studentRes = db.performances.aggregate(pipeline, allowDiskUse=True, batchSize=SCAN_BATCH_SIZE)
+    batch = []
+    written = 0
+    for sr in studentRes:
+        batch.append(ReplaceOne({"_id": sr["_id"]}, summaryDocument(sr["_id"], sr["performances"]), upsert=True))
+        written += 1
+        if(len(batch) == REBUILD_BATCH_SIZE):
+            db.summaries.bulk_write(batch, ordered=False)
+            batch = []
+    if(batch):
+        db.summaries.bulk_write(batch, ordered=False)
+    if(sids is None):
+        db.meta.update_one({"_id": "versions", "performances": versionFilter(version)}, {"$set": {"summariesOf": version}})
+    bumpVersion(db, ["summaries"])
+    return written
+
+# Inserts or replaces one semester of grades and updates everything derived from it
+# -> The student's summary and their documents in the subject collections are recomputed from their semesters
+# -> With the embedded layout, the student's semesters document is updated too
+# -> The accumulators get the new grades (and lose the replaced ones)
+# Input
+#   1) db: main database
+#   2) perf: performance document (sid, time_period and the six subjects)
+# Returns the student's new summary
+# Raises ValueError if time_period isn't between 0 and NUMSEMESTERS - 1 (nothing is written)
+def recordPerformance(db, perf):
+    perf = {k: v for k, v in perf.items() if k != "_id"}
+    sid = perf["sid"]
+    if(not isinstance(perf.get("time_period"), int) or not 0 <= perf["time_period"] < NUMSEMESTERS):
+        raise ValueError("time_period must be a semester between 0 and " + str(NUMSEMESTERS - 1))
+    version = beginPerformanceWrite(db)
+    old = db.performances.find_one_and_replace({"sid": sid, "time_period": perf["time_period"]}, perf, upsert=True)
+    incAccumulators(db, [perf])
+    if(old is not None): # Replaced grades -> take the old ones out of the totals
+        incAccumulators(db, [old], -1)
+    end = endPerformanceWrite(db, version)
+    perfs = list(db.performances.find({"sid": sid}, {"_id": 0}))
+    if(PERF_LAYOUT == "embedded"):
+        db.semesters.replace_one({"_id": sid}, semesterDocument(sid, perfs), upsert=True)
+    summary = summaryDocument(sid, perfs)
+    db.summaries.replace_one({"_id": sid}, summary, upsert=True)
+    student = db.students.find_one({"_id": sid})
+    if(student is not None):
+        for subj in SUBJECTS:
+            doc = changeDocument(student, summary["pre"]["avg"].get(subj), summary["post"]["avg"].get(subj))
+            if(doc is not None):
+                db[subj].replace_one({"_id": sid}, doc, upsert=True)
+    endSummaryWrite(db, version, end)
+    bumpVersion(db, ["semesters", "summaries", "accumulators"] + SUBJECTS)
+    return summary
+
+# Finds the same statistics as calcPeriodStats from the summaries (one document per student instead of one per semester)
+# -> Counts, sums and sums of squares add up exactly, so the means and variances match the performances scan
+# -> Checked against the performances version (see endSummaryWrite) and the number of performances, like accumulatorPeriodStats
+# Input
+#   1) summaries: The summaries collection
+# Returns a dict -> {"pre": {subject: stats}, "post": {subject: stats}}, or None if the summaries are empty or out of date
+def summaryPeriodStats(summaries):
+    db = summaries.database
+    versions = db.meta.find_one({"_id": "versions"}) or {}
+    if(versions.get("summariesOf", 0) != versions.get("performances", 0)):
+        return None
+    group = {"_id": None}
+    for period in PERIODS:
+        group[period + "_count"] = {"$sum": "$" + period + ".count"}
+        for subj in SUBJECTS:
+            group[period + "_" + subj + "_sum"] = {"$sum": "$" + period + ".sum." + subj}
+            group[period + "_" + subj + "_sumsq"] = {"$sum": "$" + period + ".sumsq." + subj}
+    totals = next(summaries.aggregate([{"$group": group}]), None)
+    if(totals is None or totals["pre_count"] + totals["post_count"] != db.performances.estimated_document_count()):
+        return None
+    stats = {}
+    for period in PERIODS:
+        stats[period] = {}
+        for subj in SUBJECTS:
+            stats[period][subj] = statsFromTotals(totals[period + "_count"], totals[period + "_" + subj + "_sum"], totals[period + "_" + subj + "_sumsq"])
+    return stats
+
+# Statistics from a count, a sum and a sum of squares (same dict as RunningStats.result)
+def statsFromTotals(count, total, sumsq):
+    if(count == 0):
+        return RunningStats().result()
+    mean = total / count
+    variance = max(0.0, sumsq / count - mean ** 2)
+    return {"count": count, "sum": total, "mean": mean, "variance": variance, "stddev": math.sqrt(variance)}
+
+# $inc updates that add (or take away) performances from the accumulators collection
+# -> accumulators has one document per time_period: {"_id": time_period, "count", "sum": {subject: total}, "sumsq": {subject: total of squares}}
+# Input
+#   1) perfs: performance documents
+#   2) sign: 1 to add them, -1 to take them away
+# Returns a list of UpdateOne (one per time_period)
+def accumulatorUpdates(perfs, sign=1):
+    incs = {}
+    for perf in perfs:
+        inc = incs.setdefault(perf["time_period"], {"count": 0})
+        inc["count"] += sign
+        for subj in SUBJECTS:
+            inc["sum." + subj] = inc.get("sum." + subj, 0) + sign * perf[subj]
+            inc["sumsq." + subj] = inc.get("sumsq." + subj, 0) + sign * perf[subj] ** 2
+    return [UpdateOne({"_id": timePeriod}, {"$inc": inc}, upsert=True) for timePeriod, inc in incs.items()]
+
+# Adds (or takes away) performances from the accumulators -> every writer of performances calls it
+# -> $inc is atomic, so concurrent writers don't lose updates
+# Input
+#   1) db: main database
+#   2) perfs: performance documents
+#   3) sign: 1 to add them, -1 to take them away
+def incAccumulators(db, perfs, sign=1):
+    updates = accumulatorUpdates(perfs, sign)
+    if(updates):
+        db.accumulators.bulk_write(updates, ordered=False)
+
+# Starts a write to performances -> bumps its version, so the accumulators don't match it until endPerformanceWrite
+# -> A writer that stops before endPerformanceWrite (crash, error) leaves them marked out of date
+# Input: db -> main database
+# Returns the performances version to pass to endPerformanceWrite
+def beginPerformanceWrite(db):
+    return nextVersion(db, "performances")
+
+# Ends a write to performances (after its incAccumulators) -> bumps its version again, so reports cached during the write are dropped
+# -> The accumulators are marked as matching the new version only if they matched before the write and no other writer bumped it meanwhile
+# Input
+#   1) db: main database
+#   2) version: from beginPerformanceWrite
+# Returns the new performances version
+def endPerformanceWrite(db, version):
+    end = nextVersion(db, "performances")
+    if(end == version + 1):
+        db.meta.update_one({"_id": "versions", "performances": end, "accumulatorsOf": versionFilter(version - 1)}, {"$set": {"accumulatorsOf": end}})
+    return end
+
+# Ends a write that updated the summaries of every student it touched (after endPerformanceWrite)
+# -> Same rule as the accumulators: marked as matching only if they matched before the write and no other writer bumped performances
+# Input
+#   1) db: main database
+#   2) version: from beginPerformanceWrite
+#   3) end: from endPerformanceWrite
+def endSummaryWrite(db, version, end):
+    if(end == version + 1):
+        db.meta.update_one({"_id": "versions", "performances": end, "summariesOf": versionFilter(version - 1)}, {"$set": {"summariesOf": end}})
+
+# Empties the summaries and marks them as matching performances (for a reload that drops performances too)
+# Input: db -> main database
+def resetSummaries(db):
+    db.summaries.drop()
+    versions = db.meta.find_one({"_id": "versions"}) or {}
+    db.meta.update_one({"_id": "versions"}, {"$set": {"summariesOf": versions.get("performances", 0)}}, upsert=True)
+
+# Empties the accumulators and marks them as matching performances (for a reload that drops performances too)
+# Input: db -> main database
+def resetAccumulators(db):
+    db.accumulators.drop()
+    versions = db.meta.find_one({"_id": "versions"}) or {}
+    db.meta.update_one({"_id": "versions"}, {"$set": {"accumulatorsOf": versions.get("performances", 0)}}, upsert=True)
+
+# (Re)builds the accumulators from performances with one $group pipeline
+# -> Marked as matching the performances version read before the pipeline, unless a writer changed it meanwhile
+# Input: db -> main database
+# Returns the number of performances counted
+def rebuildAccumulators(db):
+    version = (db.meta.find_one({"_id": "versions"}) or {}).get("performances", 0)
+    group = {"_id": "$time_period", "count": {"$sum": 1}}
+    for subj in SUBJECTS:
+        group[subj + "_sum"] = {"$sum": "$" + subj}
+        group[subj + "_sumsq"] = {"$sum": {"$multiply": ["$" + subj, "$" + subj]}}
+    docs = []
+    for gr in db.performances.aggregate([{"$group": group}]):
+        docs.append({"_id": gr["_id"], "count": gr["count"], "sum": {subj: gr[subj + "_sum"] for subj in SUBJECTS}, "sumsq": {subj: gr[subj + "_sumsq"] for subj in SUBJECTS}})
+    db.accumulators.delete_many({})
+    if(docs):
+        db.accumulators.insert_many(docs)
+    db.meta.update_one({"_id": "versions", "performances": versionFilter(version)}, {"$set": {"accumulatorsOf": version}})
+    bumpVersion(db, ["accumulators"])
+    return sum(doc["count"] for doc in docs)
+
+# Finds the same statistics as calcPeriodStats from the accumulators (at most one document per semester, whatever the number of students)
+# -> Checked against the performances version (see beginPerformanceWrite) and the number of performances,
+#    so a writer that skipped incAccumulators, replaced grades without it or stopped halfway is noticed
+# Input: db -> main database
+# Returns a dict -> {"pre": {subject: stats}, "post": {subject: stats}}, or None if the accumulators are out of date
+def accumulatorPeriodStats(db):
+    versions = db.meta.find_one({"_id": "versions"}) or {}
+    if(versions.get("accumulatorsOf", 0) != versions.get("performances", 0)):
+        return None
+    totals = {period: {"count": 0, "sum": dict.fromkeys(SUBJECTS, 0), "sumsq": dict.fromkeys(SUBJECTS, 0)} for period in PERIODS}
+    for doc in db.accumulators.find():
+        periodTotals = totals[periodOf(doc["_id"])]
+        periodTotals["count"] += doc["count"]
+        for subj in SUBJECTS:
+            periodTotals["sum"][subj] += doc["sum"][subj]
+            periodTotals["sumsq"][subj] += doc["sumsq"][subj]
+    if(totals["pre"]["count"] + totals["post"]["count"] != db.performances.estimated_document_count()):
+        return None
+    return {period: {subj: statsFromTotals(totals[period]["count"], totals[period]["sum"][subj], totals[period]["sumsq"][subj]) for subj in SUBJECTS} for period in PERIODS}
+
+# Total of a summary's prefix sums over a window (server side: 2 array lookups per student)
+def windowTotalExpr(field, window):
+    return {"$subtract": [{"$arrayElemAt": ["$prefix." + field, window[1] + 1]}, {"$arrayElemAt": ["$prefix." + field, window[0]]}]}
+
+# Compares any two windows of semesters over every student with grades in both (pre/post is PERIOD_WINDOWS["pre"] vs PERIOD_WINDOWS["post"])
+# -> One pass over summaries, each student's window averages come from their prefix sums (O(1) whatever the number of semesters)
+# Input
+#   1) summaries: The summaries collection
+#   2) first, second: (first, last) time_period windows, both included
+# Returns a dict ->
+#   "students": number of students compared
+#   "first"/"second": {subject: average of the students' window averages}
+#   "change": {subject: percent change from first to second}
+#   "missing": summaries without prefix sums (run --rebuild-summaries)
+def compareWindows(summaries, first, second):
+    project = {"firstCount": windowTotalExpr("count", first), "secondCount": windowTotalExpr("count", second)}
+    group = {"_id": None, "students": {"$sum": 1}}
+    for subj in SUBJECTS:
+        project[subj + "_first"] = windowTotalExpr(subj, first)
+        project[subj + "_second"] = windowTotalExpr(subj, second)
+        group[subj + "_first"] = {"$sum": {"$divide": ["$" + subj + "_first", "$firstCount"]}}
+        group[subj + "_second"] = {"$sum": {"$divide": ["$" + subj + "_second", "$secondCount"]}}
+    totals = next(summaries.aggregate([
+        {"$match": {"prefix": {"$exists": True}}},
+        {"$project": project},
+        {"$match": {"firstCount": {"$gt": 0}, "secondCount": {"$gt": 0}}},
+        {"$group": group}
+    ]), None)
+    res = {"first": {}, "second": {}, "change": {}, "students": 0, "missing": summaries.count_documents({"prefix": {"$exists": False}})}
+    if(totals is None):
+        return res
+    res["students"] = totals["students"]
+    for subj in SUBJECTS:
+        res["first"][subj] = totals[subj + "_first"] / totals["students"]
+        res["second"][subj] = totals[subj + "_second"] / totals["students"]
+        if(res["first"][subj] != 0):
+            res["change"][subj] = calcPercentChange(res["first"][subj], res["second"][subj])
+    return res
+
+# compareWindows, cached until the summaries change
+def cachedCompareWindows(db, first, second):
+    return cachedReport(db, ("compareWindows", first, second), ["summaries"], lambda: compareWindows(db.summaries, first, second))
+
+# Prints one window comparison
+def printWindowComparison(title, res):
+    print(title, "(", res["students"], "students with grades in both windows)")
+    if(res["missing"]):
+        print("	", res["missing"], "students have no prefix sums and are left out (run --rebuild-summaries)")
+    if(not res["students"]):
+        print("	 Nothing to compare")
+        return
+    percentChange = calcListPercentChange([(res["first"][subj], res["second"][subj]) for subj in SUBJECTS])
+    for subj, change in zip(SUBJECTS, percentChange):
+        print("	", subj[0].upper() + subj[1:], ":", round(res["first"][subj], 2), "->", round(res["second"][subj], 2), "(" + change + ")")
+
+# Compares two windows of semesters chosen by the user (ex: '0-2' and '3-5' is the pre/post COVID comparison)
+# Input: db -> main database
+# Returns nothing
+def windowComparison(db):
+    try:
+        first = parseWindow(readInput("First window (semesters, ex: '0-2'): "))
+        second = parseWindow(readInput("Second window (semesters, ex: '3-5'): "))
+    except ValueError as e:
+        print("Please state a valid input (" + str(e) + ")")
+        return
+    printWindowComparison("Semesters " + str(first[0]) + " - " + str(first[1]) + " vs " + str(second[0]) + " - " + str(second[1]), cachedCompareWindows(db, first, second))
+
+# Compares every semester with the one before it
+# Input: db -> main database
+# Returns nothing
+def semesterOverSemester(db):
+    for t in range(1, NUMSEMESTERS):
+        printWindowComparison("Semester " + str(t - 1) + " vs " + str(t), cachedCompareWindows(db, (t - 1, t - 1), (t, t)))
+
+# Streams full profiles for many students with one aggregation ($in + $lookup) instead of 2 queries per student
+# Input
+#   1) db: main database
+#   2) sids: list (or range) of student ids
+#   3) batchSize: number of profiles per batch sent by the server
+# Returns a generator of profiles -> the student document plus
+#   "performances": list of their semesters sorted by time_period
+#   "change": {subject: percent change}
+def getStudentProfiles(db, sids, batchSize=PROFILE_BATCH_SIZE):
+    if(isinstance(sids, range) and sids.step == 1): # A range doesn't need a list of every id
+        stmt = {"_id": {"$gte": sids.start, "$lt": sids.stop}}
+    else:
+        stmt = {"_id": {"$in": list(sids)}}
+    if(PERF_LAYOUT == "embedded"):
+        join = {"$lookup": {"from": "semesters", "localField": "_id", "foreignField": "_id", "as": "performances"}}
+    else:
+        join = {"$lookup": {"from": "performances", "localField": "_id", "foreignField": "sid", "as": "performances"}}
+    profileRes = db.students.aggregate([
+        {"$match": stmt},
+        {"$sort": {"_id": 1}},
+        join,
+        {"$project": {"performances._id": 0, "performances.sid": 0}}
+    ], batchSize=batchSize)
+    for profile in profileRes:
+        if(PERF_LAYOUT == "embedded"): # Semester vectors -> performance documents
+            semesters = profile["performances"]
+            profile["performances"] = expandSemesters({"_id": profile["_id"], "grades": semesters[0]["grades"]}) if semesters else []
+            for perf in profile["performances"]:
+                del perf["sid"]
+        profile["performances"].sort(key=lambda perf: perf["time_period"])
+        profile["change"] = {}
+        prefix = prefixSums(profile["performances"])
+        preAvg = windowAverages(prefix, PERIOD_WINDOWS["pre"])
+        postAvg = windowAverages(prefix, PERIOD_WINDOWS["post"])
+        if(preAvg is not None and postAvg is not None): # Needs pre and post semesters
+            for subj in SUBJECTS:
+                if(preAvg[subj]): # No percent change from a pre average of 0
+                    profile["change"][subj] = calcPercentChange(preAvg[subj], postAvg[subj])
+        yield profile
+
 # Gives info on a student (sid, gradelvl, gender, covidpos, freelunch, num_computers,
 # family size, household income, parents' educations, and school type & their school performance for different periods)
 # Input: sid (int)
 # Output: Printing a the student info & a list of grades
 def studentInfo(students, performances):
     # Get the sid
-    sid = int(input("Enter a student id: "))
+    sid = int(readInput("Enter a student id: "))
 
-    # Check if the sid is valid (1 <= sid <= 1400)
+    # Check if the sid is valid (1 <= sid <= NUMSTUDENTS)
     if(sid < 1 or sid > NUMSTUDENTS):
         print("Please enter a valid id")
         return
 
-    # Query 1: Get student info
-    stmt1 = {"_id" : sid}
-    studentRes = students.find(stmt1)
+    # Query: Get student info and performance info (one round trip)
+    studentRes = list(getStudentProfiles(students.database, [sid]))
     print("Student Info:")
     for sr in studentRes:
         print("\t Id:", sr["_id"])
@@ -166,9 +1087,9 @@ def studentInfo(students, performances):
         motherEduc = "\t Mother's Education: "
         print(motherEduc + EDUCATION[sr["mother_educ"]])
 
-    # Query 2: Get performance info
-    stmt2 = {"sid" : sid}
-    performanceRes = performances.find(stmt2, {"_id": 0, "sid":0}).sort("time_period", 1)
+    performanceRes = []
+    for sr in studentRes:
+        performanceRes = sr["performances"]
     print("\nPerformance:")
     # Print the performance info
     for pr in performanceRes:
@@ -187,24 +1108,21 @@ def studentInfo(students, performances):
 # Returns nothing
 def studentPerfChange(performances):
     # Get the sid
-    sid = int(input("Enter a student id: "))
+    sid = int(readInput("Enter a student id: "))
 
-    # Check if the sid is valid (1 <= sid <= 1400)
-    if(type(sid) != int or sid < 1 or sid > 1400):
+    # Check if the sid is valid (1 <= sid <= NUMSTUDENTS)
+    if(type(sid) != int or sid < 1 or sid > NUMSTUDENTS):
         print("Please enter a valid id")
         return
 
-    # Query: Get performance info
-    stmt = {"sid" : sid}
-    performanceRes = performances.find(stmt, {"_id": 0, "sid": 0}).sort("time_period", 1)
+    # Query: Get the student's summary (one read by _id), or build it from their semesters if summaries haven't been built
+    summary = performances.database.summaries.find_one({"_id": sid})
+    if(summary is None):
+        summary = summaryDocument(sid, readPerformances(performances.database, sid))
 
-    # Display performance for different semesters and get the pre and post covid grade totals (for avg)
-    i = 0
-    preReadingAvg = preWritingAvg = preMathAvg = preReadingSLAvg = preWritingSLAvg = preMathSLAvg = 0
-    postReadingAvg = postWritingAvg = postMathAvg = postReadingSLAvg = postWritingSLAvg = postMathSLAvg = 0
+    # Display performance for different semesters
     print("Performance:")
-    # Print the performances info and get the total scores of each subject
-    for perf in performanceRes:
+    for perf in summary["performances"]:
         print("\t Semester: ", perf["time_period"])
         print("\t\t Reading Local Level: ", perf["reading"])
         print("\t\t Writing Local Level: ", perf["writing"])
@@ -212,30 +1130,14 @@ def studentPerfChange(performances):
         print("\t\t Reading State Level (SL): ", perf["readingSL"])
         print("\t\t Writing State Level (SL): ", perf["writingSL"])
         print("\t\t Math State Level (SL): ", perf["mathSL"])
-        if i < 3:
-            preReadingAvg += perf["reading"]
-            preWritingAvg += perf["writing"]
-            preMathAvg += perf["math"]
-            preReadingSLAvg += perf["readingSL"]
-            preWritingSLAvg += perf["writingSL"]
-            preMathSLAvg += perf["mathSL"]
-        else:
-            postReadingAvg += perf["reading"]
-            postWritingAvg += perf["writing"]
-            postMathAvg += perf["math"]
-            postReadingSLAvg += perf["readingSL"]
-            postWritingSLAvg += perf["writingSL"]
-            postMathSLAvg += perf["mathSL"]
-        i += 1
     
     print("\nPerformance Analysis (using pre- and post-COVID averages)\nPre-COVID: Semesters 0 - 2\nPost-COVID: Semesters 3 - 5")
+    if(not summary["change"]):
+        print("\tNot enough semesters to compare")
+        return
 
-    # Calculate avg
-    numSem = 3
-    avgList = [(preReadingAvg, postReadingAvg), (preWritingAvg, postWritingAvg), (preMathAvg, postMathAvg), (preReadingSLAvg, postReadingSLAvg), (preWritingSLAvg, postWritingSLAvg), (preMathSLAvg, postMathSLAvg)]
-    avgList = calcDivAvgList(avgList, numSem)
-
-    # Calculate percent change
+    # Calculate percent change from the pre and post averages
+    avgList = [(summary["pre"]["avg"][subj], summary["post"]["avg"][subj]) for subj in SUBJECTS]
     percentChange = calcListPercentChange(avgList)
 
     #Print percentages
@@ -247,43 +1149,39 @@ def studentPerfChange(performances):
     print("\tMathSL: ", percentChange[5])
     return
 
+# Gets the pre and post statistics for the reports from the snapshot, the async layer or MongoDB (cached)
+# Input
+#   1) performances: Collection of performances
+#   2) snapshot: in-memory Snapshot (optional)
+#   3) asyncData: asyncdb.AsyncData to run the pre and post pipelines concurrently (optional)
+# Returns a dict -> {"pre": {subject: stats}, "post": {subject: stats}}
+def reportPeriodStats(performances, snapshot=None, asyncData=None):
+    if(snapshot is not None):
+        return snapshot.periodStats()
+    if(asyncData is not None and STATS_MODE == "server"): # The async layer runs the server pipelines, the other modes don't need it
+        compute = lambda: asyncData.run(asyncData.periodStats())
+    else:
+        compute = lambda: getPeriodStats(performances)
+    names = [perfCollection(performances.database).name]
+    if(STATS_MODE in ("summaries", "accumulators")):
+        names.append(STATS_MODE)
+    return cachedReport(performances.database, ("periodStats",), names, compute)
+
 # Displays
 #   1) The overall percent change for each subject
 #   2) The standard deviation of students pre and post COVID
 # Input
 #   1) performances: Collection of performances
+#   2) snapshot: in-memory Snapshot to compute from instead of MongoDB (optional)
+#   3) asyncData: async query layer (optional)
 # Returns nothing
-def allStudentPerfChange(performances):
-    # Query: Get performance info
-    performanceRes = performances.find({})
-    i = 0
-    preReadingAvg = preWritingAvg = preMathAvg = preReadingSLAvg = preWritingSLAvg = preMathSLAvg = 0
-    postReadingAvg = postWritingAvg = postMathAvg = postReadingSLAvg = postWritingSLAvg = postMathSLAvg = 0
+def allStudentPerfChange(performances, snapshot=None, asyncData=None):
+    # Query: Get count, mean and standard deviation for every subject (grouped in MongoDB, cached)
+    stats = reportPeriodStats(performances, snapshot, asyncData)
     print("Performance: \n  Percent Change")
-    # Get the total scores of each subject
-    for perf in performanceRes:
-        if i % 6 < 3:
-            preReadingAvg += perf["reading"]
-            preWritingAvg += perf["writing"]
-            preMathAvg += perf["math"]
-            preReadingSLAvg += perf["readingSL"]
-            preWritingSLAvg += perf["writingSL"]
-            preMathSLAvg += perf["mathSL"]
-        else:
-            postReadingAvg += perf["reading"]
-            postWritingAvg += perf["writing"]
-            postMathAvg += perf["math"]
-            postReadingSLAvg += perf["readingSL"]
-            postWritingSLAvg += perf["writingSL"]
-            postMathSLAvg += perf["mathSL"]
-        i += 1
-
-    # Calculate avg
-    numSem = 3 * 1400
-    avgList = [(preReadingAvg, postReadingAvg), (preWritingAvg, postWritingAvg), (preMathAvg, postMathAvg), (preReadingSLAvg, postReadingSLAvg), (preWritingSLAvg, postWritingSLAvg), (preMathSLAvg, postMathSLAvg)]
-    avgList = calcDivAvgList(avgList, numSem)
 
     # Calculate percent change
+    avgList = [(stats["pre"][subj]["mean"], stats["post"][subj]["mean"]) for subj in SUBJECTS]
     percentChange = calcListPercentChange(avgList)
     
     #Print percentages
@@ -293,29 +1191,44 @@ def allStudentPerfChange(performances):
         print(x, percentChange[i])
         i += 1
 
-    # Calculate Standard Deviation
+    # Print Standard Deviation
     print("\n  Standard Deviation")
-    preAvgList = [preReadingAvg/numSem, preWritingAvg/numSem, preMathAvg/numSem, preReadingSLAvg/numSem, preWritingSLAvg/numSem, preMathSLAvg/numSem]
-    postAvgList = [postReadingAvg/numSem, postWritingAvg/numSem, postMathAvg/numSem, postReadingSLAvg/numSem, postWritingSLAvg/numSem, postMathSLAvg/numSem]
-    stdPre = calcStandardDeviation(performances, preAvgList, 0)
-    stdPost = calcStandardDeviation(performances, postAvgList, 1)
-
     i = 0
-    #Print standard deviations
     for x in topicList:
-        print(x, "\n\t\tPre-COVID Mean: ", preAvgList[i])
-        print("\t\tPost-COVID Mean: ", postAvgList[i])
-        print("\t\tPre-COVID: ", stdPre[i])
-        print("\t\tPost-COVID: ", stdPost[i])
+        subj = SUBJECTS[i]
+        print(x, "\n\t\tPre-COVID Mean: ", stats["pre"][subj]["mean"])
+        print("\t\tPost-COVID Mean: ", stats["post"][subj]["mean"])
+        print("\t\tPre-COVID: ", stats["pre"][subj]["stddev"])
+        print("\t\tPost-COVID: ", stats["post"][subj]["stddev"])
         i += 1
     return
 
+# Number of students per criteria value (household income is put into its ranges)
+# Input
+#   1) students: Collection of students
+#   2) criteria: string, Ex: household_income, family_size, ...
+#   3) snapshot: in-memory Snapshot to count from instead of MongoDB (optional)
+# Returns a list of {"_id": value, "size": count} sorted by value
+def demographicCounts(students, criteria, snapshot=None):
+    if(snapshot is not None):
+        return snapshot.groupCounts(criteria)
+    if(BITMAP_INDEX): # Popcounts of the value bitmaps (only built again when students changes)
+        from bitmap import getBitmapIndex
+        return getBitmapIndex(students.database, SCAN_BATCH_SIZE).groupCounts(criteria)
+    if(criteria == "household_income"):
+        compute = lambda: aggregateBuckets(students, INCOME_BUCKETS)
+    else:
+        compute = lambda: list(aggregateStudents(students, criteria))
+    return cachedReport(students.database, ("demographic", criteria), ["students"], compute)
+
 # Gives distribution of all students based on their family size, income,
 # parents' educations, and school type in percentages
 # Input
 #   1) students: Collection of students
+#   2) snapshot: in-memory Snapshot to count from instead of MongoDB (optional)
+#   3) asyncData: async query layer (optional)
 # Returns nothing
-def studentDemographic(students):
+def studentDemographic(students, snapshot=None, asyncData=None):
     print("Which student percentage would you like to see?")
     print("1) Percent of students based on family size")
     print("2) Percent of students based on household income")
@@ -323,237 +1236,111 @@ def studentDemographic(students):
     print("4) Percent of students based on school type")
     print("5) Percent of students based on grade level")
     print("6) Percent of students based on number of computers")
+    print("7) Percent of students matching several criteria (ex: School B, free lunch and no computer)")
 
-    choice = int(input("Choice: "))
+    choice = int(readInput("Choice: "))
     if(choice == 1): # Family Size
-        studentsRes = aggregateStudents(students, "family_size")
+        studentsRes = demographicCounts(students, "family_size", snapshot)
         for sr in studentsRes:
             print("\t",round((sr["size"]/NUMSTUDENTS) * 100, 2), "% of students have a family size of ", sr["_id"])
     elif(choice == 2): # Household Income
-        studentsRes = students.aggregate([
-                {"$group": 
-                    {
-                        "_id": {
-                            "$cond" : [
-                                        {"$lte" : ["$household_income", 50000]}, "<50000", {
-                                            "$cond" : [
-                                                {"$lte" : ["$household_income", 60000]}, "50000 - 59999", {
-                                                    "$cond" : [
-                                                        {"$lte" : ["$household_income", 70000]}, "60000 - 69999", {
-                                                            "$cond" : [
-                                                                {"$lte" : ["$household_income", 80000]}, "70000 - 79999", {
-                                                                    "$cond" : [
-                                                                        {"$lte" : ["$household_income", 90000]}, "80000 - 89999", {
-                                                                            "$cond" : [
-                                                                                {"$lte" : ["$household_income", 100000]}, "90000 - 99999", ">100000"
-                                                                            ]
-                                                                        }
-                                                                    ]
-                                                                }
-                                                            ]
-                                                        }
-                                                    ]
-                                                }
-                                            ]
-                                        }
-                                ]
-                        }, 
-                    "size":{"$count" : { }}
-                    }
-                },
-                {"$sort" : 
-                    {"_id" : 1}
-                }
-            ])
+        studentsRes = demographicCounts(students, "household_income", snapshot)
         for sr in studentsRes:
             print("\t", round((sr["size"]/NUMSTUDENTS) * 100,2), "% of students have a household income of", sr["_id"])
     elif(choice == 3): # Parents' Educations
+        if(asyncData is not None and snapshot is None): # Both queries at the same time
+            fatherRes, motherRes = asyncData.run(asyncData.parentEducation())
+        else:
+            fatherRes = demographicCounts(students, "father_educ", snapshot)
+            motherRes = demographicCounts(students, "mother_educ", snapshot)
         print("Father: ")
-        studentsRes = aggregateStudents(students, "father_educ") 
-        for sr in studentsRes:
+        for sr in fatherRes:
             print("\t", round((sr["size"]/NUMSTUDENTS) * 100, 2), "% of students have a father who has", EDUCATION[sr["_id"]]) 
 
         print("Mother: ")
-        studentsRes = aggregateStudents(students, "mother_educ")
-        for sr in studentsRes:
+        for sr in motherRes:
             print("\t", round((sr["size"]/NUMSTUDENTS) * 100, 2), "% of students have a mother who has", EDUCATION[sr["_id"]]) 
     elif(choice == 4): # School
-        studentsRes = aggregateStudents(students, "school")
+        studentsRes = demographicCounts(students, "school", snapshot)
         for sr in studentsRes:
             print("\t", round((sr["size"]/NUMSTUDENTS) * 100, 2), "% of students are in", SCHOOL[sr["_id"]]) 
     elif(choice == 5): # Grade Level
-        studentsRes = aggregateStudents(students, "gradelvl")
+        studentsRes = demographicCounts(students, "gradelvl", snapshot)
         for sr in studentsRes:
             print("\t",round((sr["size"]/NUMSTUDENTS) * 100, 2), "% of students are in grade", sr["_id"])
     elif(choice == 6): # Number of Computers
-        studentsRes = aggregateStudents(students, "num_computers")
+        studentsRes = demographicCounts(students, "num_computers", snapshot)
         for sr in studentsRes:
             print("\t",round((sr["size"]/NUMSTUDENTS) * 100, 2), "% of students have", sr["_id"], "computers")
+    elif(choice == 7): # Any combination of criteria (answered from the bitmap index)
+        from bitmap import filteredDemographic
+        filteredDemographic(students.database, SCAN_BATCH_SIZE)
     else:
         print("Please state a valid input")
     return
 
-# Displays the percent change for a subject in deciles
+# Expression that gives the value of a criteria (household income is put into its ranges)
+# Input: criteria (string)
+def criteriaExpr(criteria):
+    if(criteria == "household_income"):
+        return bucketIdExpr(INCOME_BUCKETS)
+    return "$" + criteria
+
+# Groups a subject collection by percent change and by percent change + each criteria in one scan ($facet)
 # Input
 #   1) subject: Collection of performances for a specific subject
-#   2) subjectName: subject's name (string)
-#   3) criteria: criteria to group subject on (string)
-# Returns nothing
-def showChangeByX(subject, subjectName, criteria):
-    NUMSTUDENTS = 1400
-
-    # Print percent change by subject - studentsRes is a cursor
-    studentsRes = subject.aggregate([
-                {"$group": 
-                    {
-                        "_id": {
-                            "$cond" : [
-                                        {"$lte" : ["$change", 0]}, "increased", {
-                                            "$cond" : [
-                                                {"$lte" : ["$change", 10]}, "decreased by 0 - 9%", {
-                                                    "$cond" : [
-                                                        {"$lte" : ["$change", 20]}, "decreased by 10 - 19%", {
-                                                            "$cond" : [
-                                                                {"$lte" : ["$change", 30]}, "decreased by 20 - 29%", {
-                                                                    "$cond" : [
-                                                                        {"$lte" : ["$change", 40]}, "decreased by 30 - 39%", {
-                                                                            "$cond" : [
-                                                                                {"$lte" : ["$change", 50]}, "decreased by 40 - 49%", {
-                                                                                    "$cond" : [
-                                                                                        {"$lte" : ["$change", 60]}, "decreased by 50 - 59%", "decreased by >= 60%"
-                                                                                    ]
-                                                                                }
-                                                                            ]
-                                                                        }
-                                                                    ]
-                                                                }
-                                                            ]
-                                                        }
-                                                    ]
-                                                }
-                                            ]
-                                        }
-                                ]
-                        }, 
-                    "size":{"$count" : { }}
-                    }
-                },
-                {"$sort" : 
-                    {"_id" : 1}
-                }
-            ])
+#   2) criteriaList: list of criteria to group subject on (string)
+# Returns a dict -> "buckets": students per change group, criteria: students per change group and criteria value
+def aggregateChangeByCriteria(subject, criteriaList):
+    facets = {"buckets": [
+        {"$group": {"_id": bucketIdExpr(CHANGE_BUCKETS), "size": {"$count" : { }}}},
+        {"$sort": {"_id": 1}}
+    ]}
+    for criteria in criteriaList:
+        facets[criteria] = [
+            {"$group": {"_id": {"change": bucketIdExpr(CHANGE_BUCKETS), "criteria": criteriaExpr(criteria)}, "size": {"$count" : { }}}},
+            {"$sort": {"_id": 1}}
+        ]
+    facetRes = list(subject.aggregate([{"$facet": facets}]))
+    res = facetRes[0] if facetRes else {facet: [] for facet in facets}
+
+    # Bucket ids -> labels
+    for sr in res["buckets"]:
+        sr["_id"] = CHANGE_LABELS[sr["_id"]]
+    for criteria in criteriaList:
+        for sr in res[criteria]:
+            sr["_id"]["change"] = CHANGE_LABELS[sr["_id"]["change"]]
+            if(criteria == "household_income"):
+                sr["_id"]["criteria"] = INCOME_LABELS[sr["_id"]["criteria"]]
+    return res
+
+# Groups a subject collection by percent change (and by percent change + criteria)
+# Input
+#   1) subject: Collection of performances for a specific subject
+#   2) criteria: criteria to group subject on (string)
+# Returns a tuple of lists (students per change group, students per change group and criteria value)
+def aggregateChangeByX(subject, criteria):
+    res = aggregateChangeByCriteria(subject, [criteria])
+    return (res["buckets"], res[criteria])
+
+# Prints the percent of students in each change group
+# Input
+#   1) subjectName: subject's name (string)
+#   2) studentsRes: students per change group
+# Returns a dict with the number of students in each change group
+def printChangeGroups(subjectName, studentsRes):
     decileSize = {} # Stores number of students in each percentile
     for sr in studentsRes:
         decileSize[sr["_id"]] = sr["size"]
         print("\t The", subjectName ,"percent change of", round((sr["size"]/NUMSTUDENTS) * 100,2), "% of students", sr["_id"])
+    return decileSize
 
-
-    # Print demographic based on criteria
-    search = "$" + criteria
-    if(criteria != "household_income"):
-        ofStudents = subject.aggregate([
-                    {"$group": 
-                        {
-                            "_id": {
-                                "change" : {"$cond" : [
-                                            {"$lte" : ["$change", 0]}, "increased", {
-                                                "$cond" : [
-                                                    {"$lte" : ["$change", 10]}, "decreased by 0 - 9%", {
-                                                        "$cond" : [
-                                                            {"$lte" : ["$change", 20]}, "decreased by 10 - 19%", {
-                                                                "$cond" : [
-                                                                    {"$lte" : ["$change", 30]}, "decreased by 20 - 29%", {
-                                                                        "$cond" : [
-                                                                            {"$lte" : ["$change", 40]}, "decreased by 30 - 39%", {
-                                                                                "$cond" : [
-                                                                                    {"$lte" : ["$change", 50]}, "decreased by 40 - 49%", {
-                                                                                        "$cond" : [
-                                                                                            {"$lte" : ["$change", 60]}, "decreased by 50 - 59%", " decreased by >= 60%"
-                                                                                        ]
-                                                                                    }
-                                                                                ]
-                                                                            }
-                                                                        ]
-                                                                    }
-                                                                ]
-                                                            }
-                                                        ]
-                                                    }
-                                                ]
-                                            }
-                                    ]},
-                                "criteria" : search
-                            }, 
-                        "size":{"$count" : { }}
-                        }
-                    },
-                    {"$sort" : 
-                        {"_id" : 1}
-                    }
-                ])
-    else: # Handles household income ranges
-        ofStudents = subject.aggregate([
-                {"$group": 
-                    {
-                        "_id": {
-                            "change" : {"$cond" : [
-                                        {"$lte" : ["$change", 0]}, "increased", {
-                                            "$cond" : [
-                                                {"$lte" : ["$change", 10]}, "decreased by 0 - 9%", {
-                                                    "$cond" : [
-                                                        {"$lte" : ["$change", 20]}, "decreased by 10 - 19%", {
-                                                            "$cond" : [
-                                                                {"$lte" : ["$change", 30]}, "decreased by 20 - 29%", {
-                                                                    "$cond" : [
-                                                                        {"$lte" : ["$change", 40]}, "decreased by 30 - 39%", {
-                                                                            "$cond" : [
-                                                                                {"$lte" : ["$change", 50]}, "decreased by 40 - 49%", {
-                                                                                    "$cond" : [
-                                                                                        {"$lte" : ["$change", 60]}, "decreased by 50 - 59%", " decreased by >= 60%"
-                                                                                    ]
-                                                                                }
-                                                                            ]
-                                                                        }
-                                                                    ]
-                                                                }
-                                                            ]
-                                                        }
-                                                    ]
-                                                }
-                                            ]
-                                        }
-                                ]},
-                            "criteria" : {"$cond" : [
-                                    {"$lte" : ["$household_income", 50000]}, "<50000", {
-                                        "$cond" : [
-                                            {"$lte" : ["$household_income", 60000]}, "50000 - 59999", {
-                                                "$cond" : [
-                                                    {"$lte" : ["$household_income", 70000]}, "60000 - 69999", {
-                                                        "$cond" : [
-                                                            {"$lte" : ["$household_income", 80000]}, "70000 - 79999", {
-                                                                "$cond" : [
-                                                                    {"$lte" : ["$household_income", 90000]}, "80000 - 89999", {
-                                                                        "$cond" : [
-                                                                            {"$lte" : ["$household_income", 100000]}, "90000 - 99999", ">100000"
-                                                                        ]
-                                                                    }
-                                                                ]
-                                                            }
-                                                        ]
-                                                    }
-                                                ]
-                                            }
-                                        ]
-                                    }
-                            ]}
-                        }, 
-                    "size":{"$count" : { }}
-                    }
-                },
-                {"$sort" : 
-                    {"_id" : 1}
-                }
-            ])
+# Prints the criteria breakdown of each change group
+# Input
+#   1) criteria: criteria the students were grouped on (string)
+#   2) ofStudents: students per change group and criteria value
+#   3) decileSize: number of students in each change group
+def printCriteriaGroups(criteria, ofStudents, decileSize):
     print("\nOf these students")
     temp = ""
     # Prints out the info
@@ -568,47 +1355,198 @@ def showChangeByX(subject, subjectName, criteria):
             print("\t", round((sr["size"]/decileSize[sr["_id"]["change"]]) * 100,2), "% of students have a", criteria ,"of", EDUCATION[sr["_id"]["criteria"]])
         else:
             print("\t", round((sr["size"]/decileSize[sr["_id"]["change"]]) * 100,2), "% of students have a", criteria ,"of", sr["_id"]["criteria"])    
+
+# Displays the percent change for a subject in deciles
+# Input
+#   1) subject: Collection of performances for a specific subject
+#   2) subjectName: subject's name (string)
+#   3) criteria: criteria to group subject on (string)
+#   4) snapshot: in-memory Snapshot to count from instead of MongoDB (optional)
+# Returns nothing
+def showChangeByX(subject, subjectName, criteria, snapshot=None):
+    if(snapshot is not None): # Vectorized counts from the snapshot
+        studentsRes, ofStudents = snapshot.changeByX(subjectName, criteria)
+    else:
+        studentsRes, ofStudents = cachedReport(subject.database, ("changeByX", subject.name, criteria), [subject.name], lambda: aggregateChangeByX(subject, criteria))
+
+    # Print percent change by subject
+    decileSize = printChangeGroups(subjectName, studentsRes)
+    printCriteriaGroups(criteria, ofStudents, decileSize)
+    return
+
+# Displays the percent change for a subject in deciles, broken down by every criteria (one scan)
+# Input
+#   1) subject: Collection of performances for a specific subject
+#   2) subjectName: subject's name (string)
+#   3) snapshot: in-memory Snapshot to count from instead of MongoDB (optional)
+# Returns nothing
+def showChangeByAllX(subject, subjectName, snapshot=None):
+    if(snapshot is not None):
+        res = {}
+        for criteria in CHANGE_CRITERIA:
+            res["buckets"], res[criteria] = snapshot.changeByX(subjectName, criteria)
+    else:
+        res = cachedReport(subject.database, ("changeByAllX", subject.name), [subject.name], lambda: aggregateChangeByCriteria(subject, CHANGE_CRITERIA))
+
+    decileSize = printChangeGroups(subjectName, res["buckets"])
+    for criteria in CHANGE_CRITERIA:
+        print("\n--", criteria, "--")
+        printCriteriaGroups(criteria, res[criteria], decileSize)
+    return
+
+# Value of a criteria on a subject document (household income is put into its ranges -> the range id)
+# Input
+#   1) doc: subject document
+#   2) criteria: criteria (string)
+def criteriaValue(doc, criteria):
+    if(criteria == "household_income"):
+        bucket = doc.get(INCOME_BUCKETS["idField"])
+        return bucket if bucket is not None else bucketOf(doc["household_income"], INCOME_BUCKETS)
+    return doc[criteria]
+
+# Streams a subject collection once into quantile sketches of the percent change
+# -> Memory is a few thousand values per sketch, whatever the number of students
+# Input
+#   1) subject: Collection of performances for a specific subject
+#   2) criteriaList: list of criteria to split the students on (string)
+#   3) query: filter on the subject collection (optional, ex: a sid range)
+# Returns a dict -> {"overall": KLLSketch, criteria: {criteria value: KLLSketch}}
+def changeSketches(subject, criteriaList, query=None):
+    sketches = {"overall": KLLSketch()}
+    for criteria in criteriaList:
+        sketches[criteria] = {}
+    for doc in scanCursor(subject, query or {}, ["change", INCOME_BUCKETS["idField"]] + criteriaList):
+        change = doc.get("change")
+        if(change is None):
+            continue
+        sketches["overall"].add(change)
+        for criteria in criteriaList:
+            value = criteriaValue(doc, criteria)
+            if(value not in sketches[criteria]):
+                sketches[criteria][value] = KLLSketch()
+            sketches[criteria][value].add(change)
+    return sketches
+
+# Builds the sketches of one sid range of a subject collection (runs in a worker process with its own client)
+# Input
+#   1) uri: MongoDB connection string
+#   2) dbName: database name
+#   3) subjectName: subject collection's name (string)
+#   4) criteriaList: list of criteria (string)
+#   5) lo, hi: the sid range [lo, hi)
+# Returns the same dict as changeSketches
+def sketchPartition(uri, dbName, subjectName, criteriaList, lo, hi):
+    client = MongoClient(uri)
+    sketches = changeSketches(client[dbName][subjectName], criteriaList, {"_id": {"$gte": lo, "$lt": hi}})
+    client.close()
+    return sketches
+
+# Builds the same sketches as changeSketches by scanning sid ranges in parallel worker processes and merging them
+# Input
+#   1) subject: Collection of performances for a specific subject
+#   2) criteriaList: list of criteria (string)
+#   3) uri: MongoDB connection string for the workers
+#   4) workers: number of worker processes
+# Returns the same dict as changeSketches
+def parallelChangeSketches(subject, criteriaList, uri=MONGO_URI, workers=SCAN_WORKERS):
+    sketches = {"overall": KLLSketch()}
+    for criteria in criteriaList:
+        sketches[criteria] = {}
+    ranges = sidPartitions(subject.database.performances, workers * PARTITIONS_PER_WORKER)
+    dbName = subject.database.name
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(sketchPartition, uri, dbName, subject.name, criteriaList, lo, hi) for lo, hi in ranges]
+        for future in futures:
+            partial = future.result()
+            sketches["overall"].merge(partial["overall"])
+            for criteria in criteriaList:
+                for value, sketch in partial[criteria].items():
+                    if(value in sketches[criteria]):
+                        sketches[criteria][value].merge(sketch)
+                    else:
+                        sketches[criteria][value] = sketch
+    return sketches
+
+# Finds percentiles of the percent change for a subject, overall and for every value of each criteria
+# -> One pass with mergeable sketches (in worker processes with --stats-mode parallel), no sort of the whole population
+# Input
+#   1) subject: Collection of performances for a specific subject
+#   2) criteriaList: list of criteria (string)
+#   3) quantiles: list of quantiles between 0 and 1
+# Returns a dict -> "overall": {"size", "values"}, criteria: list of {"_id": criteria value, "size", "values"} sorted by value
+#   where values has the percent change at each quantile
+def changeQuantiles(subject, criteriaList, quantiles):
+    if(STATS_MODE == "parallel"):
+        sketches = parallelChangeSketches(subject, criteriaList, MONGO_URI, SCAN_WORKERS)
+    else:
+        sketches = changeSketches(subject, criteriaList)
+    res = {"overall": {"size": sketches["overall"].count, "values": sketches["overall"].quantiles(quantiles)}}
+    for criteria in criteriaList:
+        res[criteria] = []
+        for value in sorted(sketches[criteria]):
+            sketch = sketches[criteria][value]
+            label = INCOME_LABELS[value] if criteria == "household_income" else value
+            res[criteria].append({"_id": label, "size": sketch.count, "values": sketch.quantiles(quantiles)})
+    return res
+
+# Prints the percent change at each quantile
+# Input
+#   1) title: what the row is (string)
+#   2) size: number of students (int)
+#   3) quantiles: list of quantiles
+#   4) values: percent change at each quantile
+def printQuantileRow(title, size, quantiles, values):
+    print("\t", title, "(" + str(size), "students)")
+    print("\t  ", " | ".join("p" + str(round(q * 100)) + ": " + str(round(v, 2)) + "%" for q, v in zip(quantiles, values)))
+
+# Displays true quantiles (deciles by default) of the percent change for a subject, broken down by criteria
+# -> Each quantile has the same number of students, unlike the 10-point change groups of showChangeByX
+# Input
+#   1) subject: Collection of performances for a specific subject
+#   2) subjectName: subject's name (string)
+#   3) criteriaList: list of criteria to break the students down on (string)
+#   4) snapshot: in-memory Snapshot to compute from instead of MongoDB (optional)
+# Returns nothing
+def showChangeQuantiles(subject, subjectName, criteriaList, snapshot=None):
+    quantiles = QUANTILES
+    if(snapshot is not None): # Exact quantiles from the snapshot
+        res = snapshot.changeQuantiles(subjectName, criteriaList, quantiles)
+    else:
+        res = cachedReport(subject.database, ("changeQuantiles", subject.name, tuple(criteriaList), tuple(quantiles)), [subject.name], lambda: changeQuantiles(subject, criteriaList, quantiles))
+
+    print("\t Percent change of", subjectName, "grades at each percentile (a positive change is a drop)")
+    if(res["overall"]["size"] == 0):
+        print("\t No students")
+        return
+    printQuantileRow("All students", res["overall"]["size"], quantiles, res["overall"]["values"])
+    for criteria in criteriaList:
+        print("\n--", criteria, "--")
+        for sr in res[criteria]:
+            if(criteria == "freelunch"):
+                label = FREELUNCH[sr["_id"]]
+            elif(criteria == "father_educ" or criteria == "mother_educ"):
+                label = criteria + " of " + EDUCATION[sr["_id"]]
+            else:
+                label = criteria + " of " + str(sr["_id"])
+            printQuantileRow(label, sr["size"], quantiles, sr["values"])
     return
 
 # Prints overall percent change and offers the user the option to view the percent changes based on subject and criteria
 # Input
 #   1) db: main database
+#   2) snapshot: in-memory Snapshot to compute from instead of MongoDB (optional)
+#   3) asyncData: async query layer (optional)
 # Returns nothing 
-def overallAnalysis(db):
+def overallAnalysis(db, snapshot=None, asyncData=None):
     # Get collections
     performances = db.performances
-    students = db.students
 
-     # Query: Get performance info
-    performanceRes = performances.find({})
-    i = 0
-    preReadingAvg = preWritingAvg = preMathAvg = preReadingSLAvg = preWritingSLAvg = preMathSLAvg = 0
-    postReadingAvg = postWritingAvg = postMathAvg = postReadingSLAvg = postWritingSLAvg = postMathSLAvg = 0
+    # Query: Get the pre and post averages for each subject (grouped in MongoDB, cached)
+    stats = reportPeriodStats(performances, snapshot, asyncData)
     print("Performance: \n  Overall Percent Change")
-    # Get the total scores for each subject
-    for perf in performanceRes:
-        if i % 6 < 3: #pre-COVID
-            preReadingAvg += perf["reading"]
-            preWritingAvg += perf["writing"]
-            preMathAvg += perf["math"]
-            preReadingSLAvg += perf["readingSL"]
-            preWritingSLAvg += perf["writingSL"]
-            preMathSLAvg += perf["mathSL"]
-        else: #post-COVID
-            postReadingAvg += perf["reading"]
-            postWritingAvg += perf["writing"]
-            postMathAvg += perf["math"]
-            postReadingSLAvg += perf["readingSL"]
-            postWritingSLAvg += perf["writingSL"]
-            postMathSLAvg += perf["mathSL"]
-        i += 1
-
-    # Calculate avg
-    numSem = 3 * NUMSTUDENTS
-    avgList = [(preReadingAvg, postReadingAvg), (preWritingAvg, postWritingAvg), (preMathAvg, postMathAvg), (preReadingSLAvg, postReadingSLAvg), (preWritingSLAvg, postWritingSLAvg), (preMathSLAvg, postMathSLAvg)]
-    avgList = calcDivAvgList(avgList, numSem)
 
     # Calculate percent change
+    avgList = [(stats["pre"][subj]["mean"], stats["post"][subj]["mean"]) for subj in SUBJECTS]
     percentChange = calcListPercentChange(avgList)
     
     #Print percentages overall
@@ -619,7 +1557,7 @@ def overallAnalysis(db):
         i += 1
 
     #Print percentages per subject and separated into deciles
-    print("  Percent Changes by Subject (separated into deciles)")
+    print("  Percent Changes by Subject (separated into 10-point change groups, or into deciles with 'q')")
     # User input
     choice = -1
     while(choice != "quit"):
@@ -636,10 +1574,19 @@ def overallAnalysis(db):
         print("d) Father's Education")
         print("e) Mother's Education")
         print("f) Number of Household Computers")
+        print("g) All of the above")
+        print("Add 'q' for true deciles instead of change groups (ex: '3bq')")
+        print("To ask a question over several criteria at once (ex: School B x income <50000 x math), enter 'cube'")
         print("To quit, enter 'quit'")
-        choice = input("Choice: ")
+        choice = readInput("Choice: ")
+
+        if(choice == "cube"): # Answered from the pre-aggregated cube (only needs NumPy when used)
+            from cube import cubeQuery
+            with profileReport("cubeQuery"):
+                cubeQuery(db, PERF_LAYOUT, SCAN_BATCH_SIZE)
+            continue
 
-        if(len(choice) < 2 or ((choice[0] < '1' or choice[0] > '6' or choice[1] < 'a' or choice[1] > 'f') and choice != "quit")): # Check user input
+        if(len(choice) < 2 or ((choice[0] < '1' or choice[0] > '6' or choice[1] < 'a' or choice[1] > 'g' or choice[2:] not in ("", "q")) and choice != "quit")): # Check user input
             print("Please state a valid input\n")
         else: #Choose a subject
             if(choice[0] == '1'):
@@ -680,32 +1627,101 @@ def overallAnalysis(db):
                 criteria = "mother_educ"
             elif(choice[1] == 'f'):
                 criteria = "num_computers"
-            if(choice != "quit"):
-                showChangeByX(col, name, criteria)
-
-    # Populate collections
-    #for subj in topicList:
-        #col = db[subj]
-        #for i in range(1,1401):
-            #student = students.find({"_id" : i})
-            #studentPerformance = performances.find({"sid" : i}, {"_id": 0, "sid": 0}).sort("time_period", 1)
-            #change = calcPercentChangeBySubject(studentPerformance, subj)
-            #for s in student:
-                #col.insert_one({"_id" : i, "school" : s["school"], "gender" : s["gender"], "household_income" : s["household_income"], "freelunch" : s["freelunch"], "num_computers" : s["num_computers"], "family_size" : s["family_size"], "father_educ" : s["father_educ"], "mother_educ" : s["mother_educ"] ,"change": change})
-        #print("Finished", col)
+            elif(choice[1] == 'g'):
+                criteria = "all"
+            if(choice != "quit" and choice[2:] == "q"):
+                with profileReport("showChangeQuantiles"):
+                    showChangeQuantiles(col, name, CHANGE_CRITERIA if criteria == "all" else [criteria], snapshot)
+            elif(choice != "quit" and criteria == "all"):
+                with profileReport("showChangeByAllX"):
+                    showChangeByAllX(col, name, snapshot)
+            elif(choice != "quit"):
+                with profileReport("showChangeByX"):
+                    showChangeByX(col, name, criteria, snapshot)
+
     return
 
 def main():
+    global STATS_MODE, SCAN_WORKERS, QUANTILES, SCAN_BATCH_SIZE, PERF_LAYOUT, BITMAP_INDEX, NUMSTUDENTS
+    parser = argparse.ArgumentParser(description="COVID-19 effect on student grades")
+    parser.add_argument("--rebuild-changes", action="store_true", help="rebuild the per-subject change collections and exit")
+    parser.add_argument("--rebuild-summaries", action="store_true", help="rebuild the per-student summaries and exit")
+    parser.add_argument("--rebuild-accumulators", action="store_true", help="rebuild the pre/post running totals from performances and exit")
+    parser.add_argument("--restart", action="store_true", help="with --rebuild-changes: ignore saved progress and start over")
+    parser.add_argument("--store-bucket-ids", action="store_true", help="save change/income bucket ids on the documents (run after changing the bins) and exit")
+    parser.add_argument("--skip-index-check", action="store_true", help="don't create indexes or check query plans at startup")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="run independent queries concurrently with motor/asyncio")
+    parser.add_argument("--stats-mode", choices=["accumulators", "server", "python", "parallel", "summaries"], default=STATS_MODE, help="where the pre/post statistics are computed")
+    parser.add_argument("--workers", type=int, default=SCAN_WORKERS, help="worker processes for --stats-mode parallel")
+    parser.add_argument("--scan-batch-size", type=int, default=SCAN_BATCH_SIZE, help="documents per batch when scanning a collection")
+    parser.add_argument("--layout", choices=["auto", "rows", "embedded"], default="auto", help="where the grades are read from: performances (rows), semesters (embedded) or whichever migrate.py last switched to (auto)")
+    parser.add_argument("--bitmap-index", action="store_true", help="answer the student demographic percentages from an in-process bitmap index")
+    parser.add_argument("--percentiles", help="comma separated percentiles for the 'q' reports (ex: 5,25,50,75,95), deciles by default")
+    parser.add_argument("--profile", action="store_true", help="time every database call and print a per-report breakdown at exit")
+    parser.add_argument("--profile-explain", action="store_true", help="with --profile: also re-run the queries with explain(executionStats)")
+    parser.add_argument("--profile-output", default="profile_output.json", help="file the --profile breakdown is written to")
+    parser.add_argument("--snapshot", action="store_true", help="load the data into an in-memory NumPy snapshot (cached on disk) and run the reports on it")
+    args = parser.parse_args()
+    STATS_MODE = args.stats_mode
+    SCAN_WORKERS = args.workers
+    SCAN_BATCH_SIZE = args.scan_batch_size
+    BITMAP_INDEX = args.bitmap_index
+    if(args.percentiles):
+        QUANTILES = [float(p) / 100 for p in args.percentiles.split(",")]
+
     # connect to MongoDB
-    client = MongoClient("mongodb://localhost:27017")
+    profiler = None
+    listeners = []
+    if(args.profile):
+        profiler = QueryProfiler(args.profile_explain)
+        listeners.append(profiler)
+    client = MongoClient(MONGO_URI, event_listeners=listeners)
     db = client.covid19stud
+    PERF_LAYOUT = detectLayout(db) if args.layout == "auto" else args.layout
+
+    # Make sure the indexes exist and are used before running anything
+    if(not args.skip_index_check):
+        with profileReport("startup"):
+            ensureIndexes(db)
+            verifyQueryPlans(db)
+
+    if(args.rebuild_changes):
+        written, skipped = rebuildChangeCollections(db, args.restart)
+        print("Rebuilt the subject collections for", written, "students (", skipped, "without pre and post grades in some subject )")
+        return
+    if(args.rebuild_summaries):
+        written = rebuildSummaries(db)
+        print("Rebuilt the summaries for", written, "students")
+        return
+    if(args.rebuild_accumulators):
+        counted = rebuildAccumulators(db)
+        print("Rebuilt the accumulators from", counted, "performances")
+        return
+    if(args.store_bucket_ids):
+        storeBucketIds(db.students, INCOME_BUCKETS)
+        for subj in SUBJECTS:
+            storeBucketIds(db[subj], CHANGE_BUCKETS)
+            storeBucketIds(db[subj], INCOME_BUCKETS)
+        print("Saved the bucket ids")
+        return
 
     # Get collections from database (or create if they don't exist)
     students = db.students
     performances = db.performances
 
+    snapshot = None
+    if(args.snapshot): # Only needs NumPy when the snapshot is used
+        from snapshot import loadSnapshot
+        snapshot = loadSnapshot(db, PERF_LAYOUT)
+
+    asyncData = None
+    if(args.use_async): # Only needs motor when the async layer is used
+        from asyncdb import AsyncData
+        asyncData = AsyncData(MONGO_URI, PERF_LAYOUT)
+
     # Get population size - performances has multiple values for students -> use students
-    population = students.estimated_document_count()
+    # -> The percentages and the sid checks use it, so any dataset size is reported correctly
+    NUMSTUDENTS = students.estimated_document_count()
 
     # User input
     choice = -1
@@ -714,35 +1730,58 @@ def main():
         print("1) Student Info")
         print("2) Performance Changes")
         print("3) Overall Analysis")
+        print("4) What Drives the Grade Change (correlations and regression)")
         choice = int(input("Choice: "))
 
         if(choice == 1): # Choose a student info option
-            print("a) Specific Student (IDs range from 1 - 1400)")
+            print("a) Specific Student (IDs range from 1 -", str(NUMSTUDENTS) + ")")
             print("b) Student Demographic (Data will be displayed as percentages)")
             studentChoice = input("Choice: ")
 
             if(studentChoice == 'a'):
-                studentInfo(students, performances)
+                with profileReport("studentInfo"):
+                    studentInfo(students, performances)
             elif(studentChoice == 'b'):
-                studentDemographic(students)
+                with profileReport("studentDemographic"):
+                    studentDemographic(students, snapshot, asyncData)
             else:
                 print("Please state a valid input")
         elif(choice == 2): # Choose a student performance option
-            print("a) Specific Student (IDs range from 1 - 1400)")
+            print("a) Specific Student (IDs range from 1 -", str(NUMSTUDENTS) + ")")
             print("b) All Students")
+            print("c) Compare Two Windows of Semesters")
+            print("d) Semester over Semester")
             studentChoice = input("Choice: ")
 
             if(studentChoice == 'a'):
-                studentPerfChange(performances)
+                with profileReport("studentPerfChange"):
+                    studentPerfChange(performances)
             elif(studentChoice == 'b'):
-                allStudentPerfChange(performances)
+                with profileReport("allStudentPerfChange"):
+                    allStudentPerfChange(performances, snapshot, asyncData)
+            elif(studentChoice == 'c'):
+                with profileReport("windowComparison"):
+                    windowComparison(db)
+            elif(studentChoice == 'd'):
+                with profileReport("semesterOverSemester"):
+                    semesterOverSemester(db)
             else:
                 print("Please state a valid input")
         elif(choice == 3): # Overall analysis
-            overallAnalysis(db)
+            with profileReport("overallAnalysis"):
+                overallAnalysis(db, snapshot, asyncData)
+        elif(choice == 4): # Correlations and regression (only needs NumPy when used)
+            from drivers import showChangeDrivers
+            with profileReport("showChangeDrivers"):
+                showChangeDrivers(db, snapshot, PERF_LAYOUT)
         elif(choice != 0):
             print("Please state a valid input")
 
+    if(asyncData is not None):
+        asyncData.close()
+    if(profiler is not None):
+        profiler.writeReport(args.profile_output, client)
+
 # Execute main
 if __name__ == "__main__":
     main()
@@ -0,0 +1,247 @@
+import argparse
+import asyncio
+import json
+from urllib.parse import parse_qs, urlsplit
+
+from pymongo import MongoClient
+
+import project3
+from project3 import MONGO_URI, SUBJECTS, CHANGE_CRITERIA, PERIOD_WINDOWS, cachedCompareWindows, detectLayout, cachedReport, calcListPercentChange, getStudentProfiles, parseWindow, readPerformances, summaryDocument
+
+#constants
+HOST = "127.0.0.1"
+PORT = 8080
+MAX_POOL_SIZE = 50 # Connections in the shared MongoClient pool
+DEMOGRAPHIC_CRITERIA = ["family_size", "household_income", "father_educ", "mother_educ", "school", "gradelvl", "num_computers", "gender", "covidpos", "freelunch"]
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+
+# Raised by a report for a bad request (turned into a 400 or 404 response)
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+# Runs identical requests that arrive while one is already running only once
+# -> Every caller with the same key waits on the same task, so polling dashboards don't multiply the queries
+class Coalescer:
+    def __init__(self):
+        self.inFlight = {} # key -> asyncio.Task
+        self.coalesced = 0 # Requests answered by a task that was already running
+
+    # Input
+    #   1) key: identifies the request (hashable)
+    #   2) func, *args: blocking function to run on a worker thread
+    # Returns the function's result
+    async def run(self, key, func, *args):
+        task = self.inFlight.get(key)
+        if(task is None):
+            task = asyncio.ensure_future(asyncio.to_thread(func, *args))
+            self.inFlight[key] = task
+            task.add_done_callback(lambda done: self.inFlight.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task) # A caller that disconnects doesn't cancel the query for the others
+
+# The reports as JSON-ready dicts (run on worker threads, they use the same queries and cache as the menus)
+# Input: db -> main database, plus the request's parameters
+def studentInfoReport(db, sid):
+    profiles = list(getStudentProfiles(db, [sid]))
+    if(not profiles):
+        raise RequestError(404, "No student with id " + str(sid))
+    return profiles[0]
+
+def studentChangeReport(db, sid):
+    summary = db.summaries.find_one({"_id": sid})
+    if(summary is None):
+        summary = summaryDocument(sid, readPerformances(db, sid))
+    if(not summary["change"]):
+        raise RequestError(404, "No pre and post COVID grades for student " + str(sid))
+    return {"sid": sid, "performances": summary["performances"], "change": summary["change"]}
+
+def allStudentChangeReport(db):
+    stats = project3.reportPeriodStats(db.performances)
+    avgList = [(stats["pre"][subj]["mean"], stats["post"][subj]["mean"]) for subj in SUBJECTS]
+    return {"change": dict(zip(SUBJECTS, calcListPercentChange(avgList))), "stats": stats}
+
+def demographicReport(db, criteria, where):
+    if(criteria not in DEMOGRAPHIC_CRITERIA):
+        raise RequestError(404, "Unknown criteria " + criteria)
+    if(where):
+        from bitmap import getBitmapIndex, parseFilters
+        try:
+            filters = parseFilters(where)
+        except ValueError as e:
+            raise RequestError(400, str(e))
+        counts = getBitmapIndex(db, project3.SCAN_BATCH_SIZE).groupCounts(criteria, filters)
+    else:
+        counts = project3.demographicCounts(db.students, criteria)
+    total = sum(sr["size"] for sr in counts)
+    return {"criteria": criteria, "students": total, "groups": [{"value": sr["_id"], "size": sr["size"], "percent": round(sr["size"] / total * 100, 2)} for sr in counts], "where": where}
+
+def changeByCriteriaReport(db, subject, criteria, quantiles):
+    if(subject not in SUBJECTS):
+        raise RequestError(404, "Unknown subject " + subject)
+    if(criteria != "all" and criteria not in CHANGE_CRITERIA):
+        raise RequestError(404, "Unknown criteria " + criteria)
+    criteriaList = CHANGE_CRITERIA if criteria == "all" else [criteria]
+    col = db[subject]
+    if(quantiles):
+        return cachedReport(db, ("changeQuantiles", subject, tuple(criteriaList), tuple(project3.QUANTILES)), [subject], lambda: project3.changeQuantiles(col, criteriaList, project3.QUANTILES))
+    if(criteria == "all"):
+        return cachedReport(db, ("changeByAllX", subject), [subject], lambda: project3.aggregateChangeByCriteria(col, CHANGE_CRITERIA))
+    buckets, ofStudents = cachedReport(db, ("changeByX", subject, criteria), [subject], lambda: project3.aggregateChangeByX(col, criteria))
+    return {"buckets": buckets, criteria: ofStudents}
+
+def windowReport(db, firstText, secondText):
+    try:
+        first = parseWindow(firstText) if firstText else PERIOD_WINDOWS["pre"]
+        second = parseWindow(secondText) if secondText else PERIOD_WINDOWS["post"]
+    except ValueError as e:
+        raise RequestError(400, str(e))
+    return dict(cachedCompareWindows(db, first, second), firstWindow=first, secondWindow=second)
+
+def cubeReport(db, sliceText, groupText):
+    from cube import DIMENSIONS, getCube, parseFilters # Only needs NumPy when the cube is used
+    groupBy = groupText.replace(",", " ").split()
+    try:
+        filters = parseFilters(sliceText)
+    except ValueError as e:
+        raise RequestError(400, str(e))
+    for dim in groupBy:
+        if(dim not in DIMENSIONS):
+            raise RequestError(400, "Unknown dimension " + dim)
+    return {"slice": filters, "groupBy": groupBy, "rows": getCube(db, project3.PERF_LAYOUT, project3.SCAN_BATCH_SIZE).query(filters, groupBy)}
+
+def driversReport(db):
+    from drivers import changeDrivers # Only needs NumPy when used
+    from snapshot import loadSnapshot
+    return changeDrivers(loadSnapshot(db, project3.PERF_LAYOUT))
+
+# Matches a request path to a report
+# Input
+#   1) db: main database
+#   2) path: list of path segments, Ex: ["students", "12", "change"]
+#   3) query: dict of query string values
+# Returns a tuple (function, args)
+def route(db, path, query):
+    if(path == ["health"]):
+        return (lambda: {"ok": True}, ())
+    if(len(path) in (2, 3) and path[0] == "students"):
+        try:
+            sid = int(path[1])
+        except ValueError:
+            raise RequestError(400, "Student id must be an integer")
+        if(len(path) == 2):
+            return (studentInfoReport, (db, sid))
+        if(path[2] == "change"):
+            return (studentChangeReport, (db, sid))
+    if(path == ["performance"]):
+        return (allStudentChangeReport, (db,))
+    if(len(path) == 2 and path[0] == "demographics"):
+        return (demographicReport, (db, path[1], query.get("where", "")))
+    if(path == ["windows"]):
+        return (windowReport, (db, query.get("first", ""), query.get("second", "")))
+    if(path == ["drivers"]):
+        return (driversReport, (db,))
+    if(path == ["cube"]):
+        return (cubeReport, (db, query.get("slice", ""), query.get("group", "")))
+    if(len(path) == 3 and path[0] == "change"):
+        return (changeByCriteriaReport, (db, path[1], path[2], query.get("quantiles") in ("1", "true")))
+    raise RequestError(404, "Unknown report /" + "/".join(path))
+
+# Serves the reports as JSON over HTTP with one shared (pooled) MongoClient
+# -> Each request runs its report on a worker thread, so slow reports don't block the others
+# Endpoints (GET)
+#   /students/<sid>                      student info, semesters and percent changes
+#   /students/<sid>/change               a student's semesters and percent changes
+#   /performance                         percent change and pre/post statistics for all students
+#   /demographics/<criteria>             students per criteria value (?where=school=1 freelunch=1 for the students matching a filter)
+#   /change/<subject>/<criteria or all>  students per change group and criteria value (?quantiles=1 for percentiles)
+#   /windows?first=0-2&second=3-5        averages and percent change between two windows of semesters (pre/post by default)
+#   /cube?slice=...&group=...            roll-up of the pre-aggregated cube (ex: slice=school=1 subject=math, group=change)
+#   /drivers                             correlation and regression of every demographic with every subject's percent change
+class ReportService:
+    def __init__(self, db):
+        self.db = db
+        self.coalescer = Coalescer()
+
+    # Answers one request
+    # Returns a tuple (status, body dict)
+    async def respond(self, method, target):
+        if(method != "GET"):
+            return (405, {"error": "Only GET is supported"})
+        url = urlsplit(target)
+        path = [part for part in url.path.split("/") if part]
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        try:
+            func, args = route(self.db, path, query)
+            key = (tuple(path), tuple(sorted(query.items())))
+            return (200, await self.coalescer.run(key, func, *args))
+        except RequestError as e:
+            return (e.status, {"error": str(e)})
+        except Exception as e: # Report failed (ex: database unreachable) -> the service keeps running
+            return (500, {"error": type(e).__name__ + ": " + str(e)})
+
+    # Reads requests from one connection (keep-alive) and writes the responses
+    async def handle(self, reader, writer):
+        try:
+            while(True):
+                requestLine = await reader.readline()
+                if(not requestLine.strip()):
+                    break
+                parts = requestLine.decode("latin-1").split()
+                headers = {}
+                while(True):
+                    line = await reader.readline()
+                    if(line in (b"\r\n", b"\n", b"")):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                if(len(parts) != 3):
+                    status, body = (400, {"error": "Malformed request line"})
+                else:
+                    status, body = await self.respond(parts[0], parts[1])
+                keepAlive = headers.get("connection", "").lower() != "close" and parts[-1] == "HTTP/1.1"
+                payload = json.dumps(body, default=str).encode()
+                writer.write(("HTTP/1.1 " + str(status) + " " + STATUS_TEXT[status] + "\r\n"
+                              "Content-Type: application/json\r\n"
+                              "Content-Length: " + str(len(payload)) + "\r\n"
+                              "Connection: " + ("keep-alive" if keepAlive else "close") + "\r\n\r\n").encode() + payload)
+                await writer.drain()
+                if(not keepAlive):
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host=HOST, port=PORT):
+        server = await asyncio.start_server(self.handle, host, port)
+        print("Serving reports on http://" + host + ":" + str(port))
+        async with server:
+            await server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the reports as JSON over HTTP")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--uri", default=MONGO_URI)
+    parser.add_argument("--db", default="covid19stud")
+    parser.add_argument("--pool-size", type=int, default=MAX_POOL_SIZE, help="connections in the MongoClient pool")
+    parser.add_argument("--layout", choices=["auto", "rows", "embedded"], default="auto", help="where the grades are read from: performances (rows), semesters (embedded) or whichever migrate.py last switched to (auto)")
+    args = parser.parse_args()
+
+    client = MongoClient(args.uri, maxPoolSize=args.pool_size)
+    db = client[args.db]
+    project3.PERF_LAYOUT = detectLayout(db) if args.layout == "auto" else args.layout
+    service = ReportService(db)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.close()
+
+# Execute main
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import math
+import random
+
+#constants
+SKETCH_K = 200 # Size of the top compactor -> rank error is about 1.7 / SKETCH_K (under 1% of the population)
+SKETCH_C = 2 / 3 # Each lower compactor holds this fraction of the one above it
+
+# Streaming quantile sketch (KLL: Karnin, Lang, Liberty)
+# -> Keeps a stack of compactors: level h holds values that each stand for 2^h values of the stream
+# -> When a level is full it is sorted and every other value moves up a level, so memory is O(k) whatever the stream size
+# -> Sketches of different partitions can be merged, the result is as accurate as one sketch over everything
+# -> Exact while fewer than about k values have been added
+class KLLSketch:
+    def __init__(self, k=SKETCH_K, seed=0):
+        self.k = k
+        self.compactors = [[]]
+        self.count = 0 # Values added (including the ones merged in)
+        self.size = 0 # Values held
+        self.maxSize = self.capacity(0)
+        self.rnd = random.Random(seed)
+
+    # Number of values level h can hold before it is compacted
+    def capacity(self, h):
+        height = len(self.compactors) - h - 1
+        return int(math.ceil(SKETCH_C ** height * self.k)) + 1
+
+    def grow(self):
+        self.compactors.append([])
+        self.maxSize = sum(self.capacity(h) for h in range(len(self.compactors)))
+
+    def add(self, value):
+        self.compactors[0].append(value)
+        self.count += 1
+        self.size += 1
+        if(self.size >= self.maxSize):
+            self.compress()
+
+    # Compacts the lowest full level (sorted, then every other value moves up with twice the weight)
+    def compress(self):
+        for h in range(len(self.compactors)):
+            level = self.compactors[h]
+            if(len(level) >= self.capacity(h)):
+                if(h + 1 >= len(self.compactors)):
+                    self.grow()
+                level.sort()
+                keep = [level.pop()] if len(level) % 2 == 1 else [] # An odd value out stays on this level
+                offset = self.rnd.randint(0, 1) # Random half -> the rank error is unbiased
+                self.compactors[h + 1].extend(level[offset::2])
+                self.compactors[h] = keep
+                break
+        self.size = sum(len(level) for level in self.compactors)
+
+    # Adds another sketch's values to this one
+    # Input: other (KLLSketch)
+    def merge(self, other):
+        while(len(self.compactors) < len(other.compactors)):
+            self.grow()
+        for h, level in enumerate(other.compactors):
+            self.compactors[h].extend(level)
+        self.count += other.count
+        self.size = sum(len(level) for level in self.compactors)
+        while(self.size >= self.maxSize):
+            self.compress()
+
+    # Finds several quantiles at once
+    # Input: qs -> list of quantiles between 0 and 1 (ex: 0.5 is the median)
+    # Returns a list with the value at each quantile (None if the sketch is empty)
+    def quantiles(self, qs):
+        weighted = sorted((value, 2 ** h) for h, level in enumerate(self.compactors) for value in level)
+        total = sum(weight for value, weight in weighted)
+        res = []
+        for q in qs:
+            if(not weighted):
+                res.append(None)
+                continue
+            target = q * total
+            seen = 0
+            found = weighted[-1][0]
+            for value, weight in weighted:
+                seen += weight
+                if(seen >= target): # The first value with at least q of the weight at or below it
+                    found = value
+                    break
+            res.append(found)
+        return res
+
+    def quantile(self, q):
+        return self.quantiles([q])[0]
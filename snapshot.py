@@ -0,0 +1,206 @@
+import json
+import os
+import shutil
+
+import numpy as np
+
+from project3 import SUBJECTS, PERIODS, NUMSEMESTERS, COVIDSEMESTER, CHANGE_EDGES, CHANGE_LABELS, INCOME_EDGES, INCOME_LABELS, collectionVersion, perfCollection, scanPerformances
+
+#constants
+SNAPSHOT_DIR = ".snapshot" # Where the memory-mapped arrays are cached
+DEMOGRAPHICS = ["school", "gradelvl", "gender", "covidpos", "household_income", "freelunch", "num_computers", "family_size", "father_educ", "mother_educ"]
+BOOLFIELDS = ["school", "gender", "covidpos", "freelunch"]
+MISSING = -1 # Grade value for a semester that has no performance document
+
+# Columnar copy of the students and performances collections
+#   sids: (students,) student ids, sorted
+#   grades: (students, semesters, subjects) grades, MISSING where there is no document
+#   columns: {field: (students,)} demographic columns aligned with sids
+class Snapshot:
+    def __init__(self, sids, grades, columns):
+        self.sids = sids
+        self.grades = grades
+        self.columns = columns
+
+    # Grades as floats with NaN for missing semesters (so nan-functions skip them)
+    def floatGrades(self):
+        grades = self.grades.astype(np.float64)
+        grades[self.grades == MISSING] = np.nan
+        return grades
+
+    # Same result as project3.getPeriodStats, computed with vectorized operations
+    # Returns a dict -> {"pre": {subject: stats}, "post": {subject: stats}}
+    def periodStats(self):
+        grades = self.floatGrades()
+        halves = {"pre": grades[:, :COVIDSEMESTER, :], "post": grades[:, COVIDSEMESTER:, :]}
+        stats = {}
+        for period in PERIODS:
+            values = halves[period].reshape(-1, len(SUBJECTS))
+            counts = np.sum(~np.isnan(values), axis=0)
+            sums = np.nansum(values, axis=0)
+            means = np.divide(sums, counts, out=np.zeros(len(SUBJECTS)), where=counts > 0)
+            variances = np.nansum((values - means) ** 2, axis=0) / np.maximum(counts, 1)
+            stats[period] = {}
+            for i, subj in enumerate(SUBJECTS):
+                stats[period][subj] = {"count": int(counts[i]), "sum": int(sums[i]), "mean": float(means[i]), "variance": float(variances[i]), "stddev": float(np.sqrt(variances[i]))}
+        return stats
+
+    # Percent change of every student for every subject (same rounding as calcPercentChange)
+    # Returns a (students, subjects) array
+    def studentChanges(self):
+        grades = self.floatGrades()
+        with np.errstate(invalid="ignore", divide="ignore"):
+            pre = np.nanmean(grades[:, :COVIDSEMESTER, :], axis=1)
+            post = np.nanmean(grades[:, COVIDSEMESTER:, :], axis=1)
+            return np.round(((pre - post) / pre) * 100, 2)
+
+    # Values of a demographic column, household income is put into its ranges
+    # Returns (keys, labels) -> keys are sortable, labels are what the reports display
+    def criteriaValues(self, criteria):
+        column = np.asarray(self.columns[criteria])
+        if(criteria == "household_income"):
+            idx = np.searchsorted(INCOME_EDGES, column, side="left")
+            return idx, np.asarray(INCOME_LABELS, dtype=object)[idx]
+        return column, column
+
+    # Same result as project3.aggregateStudents: number of students per criteria value
+    # Returns a list of {"_id": value, "size": count} sorted by value
+    def groupCounts(self, criteria):
+        keys, labels = self.criteriaValues(criteria)
+        values, first, counts = np.unique(keys, return_index=True, return_counts=True)
+        return [{"_id": toPython(labels[first[i]]), "size": int(counts[i])} for i in range(len(values))]
+
+    # Same result as project3.aggregateChangeByX (groups in bucket order)
+    # Input
+    #   1) subjectName: subject's name (string)
+    #   2) criteria: criteria to group on (string)
+    # Returns a tuple of lists (students per change group, students per change group and criteria value)
+    def changeByX(self, subjectName, criteria):
+        changes = self.studentChanges()[:, SUBJECTS.index(subjectName)]
+        valid = ~np.isnan(changes)
+        bucket = np.searchsorted(CHANGE_EDGES, changes[valid], side="left")
+        bucketLabels = np.asarray(CHANGE_LABELS, dtype=object)[bucket]
+
+        values, counts = np.unique(bucket, return_counts=True)
+        studentsRes = [{"_id": CHANGE_LABELS[v], "size": int(c)} for v, c in zip(values, counts)]
+
+        keys, labels = self.criteriaValues(criteria)
+        keys, labels = keys[valid], labels[valid]
+        pairs, first, counts = np.unique(np.stack([bucket, keys.astype(np.int64)]), axis=1, return_index=True, return_counts=True)
+        ofStudents = [{"_id": {"change": bucketLabels[first[i]], "criteria": toPython(labels[first[i]])}, "size": int(counts[i])} for i in range(pairs.shape[1])]
+        return (studentsRes, ofStudents)
+
+    # Same result as project3.changeQuantiles, but exact (every change is already in memory)
+    # -> "inverted_cdf" picks the first value with at least q of the students at or below it, like the sketch
+    # Input
+    #   1) subjectName: subject's name (string)
+    #   2) criteriaList: list of criteria (string)
+    #   3) quantiles: list of quantiles between 0 and 1
+    def changeQuantiles(self, subjectName, criteriaList, quantiles):
+        changes = self.studentChanges()[:, SUBJECTS.index(subjectName)]
+        valid = ~np.isnan(changes)
+        changes = changes[valid]
+        res = {"overall": {"size": int(changes.size), "values": quantileValues(changes, quantiles)}}
+        for criteria in criteriaList:
+            keys, labels = self.criteriaValues(criteria)
+            keys, labels = keys[valid], labels[valid]
+            values, first = np.unique(keys, return_index=True)
+            res[criteria] = []
+            for value, i in zip(values, first):
+                group = changes[keys == value]
+                res[criteria].append({"_id": toPython(labels[i]), "size": int(group.size), "values": quantileValues(group, quantiles)})
+        return res
+
+# Quantiles of an array as Python floats (None when the array is empty)
+def quantileValues(values, quantiles):
+    if(values.size == 0):
+        return [None] * len(quantiles)
+    return [float(v) for v in np.quantile(values, quantiles, method="inverted_cdf")]
+
+# Converts a NumPy scalar to the Python type the reports expect
+def toPython(value):
+    if(isinstance(value, np.generic)):
+        return value.item()
+    return value
+
+# Identifies the current contents of the students collection and the grades (performances or semesters)
+# -> The version counters bumped on every write (see project3.collectionVersion), so nothing is hashed or scanned
+# Input
+#   1) db: main database
+#   2) layout: "rows" or "embedded", where the grades are read from
+# Returns a string that changes whenever the collections change
+def collectionFingerprint(db, layout="rows"):
+    return repr(collectionVersion(db, ["students", perfCollection(db, layout).name]))
+
+# Reads the students and performances collections into a Snapshot (2 scans)
+# Input
+#   1) db: main database
+#   2) layout: "rows" or "embedded", where the grades are read from
+# Returns a Snapshot
+def buildSnapshot(db, layout="rows"):
+    projection = {field: 1 for field in DEMOGRAPHICS}
+    studentList = list(db.students.find({}, projection).sort("_id", 1))
+    sids = np.array([s["_id"] for s in studentList], dtype=np.int64)
+    columns = {}
+    for field in DEMOGRAPHICS:
+        dtype = np.bool_ if field in BOOLFIELDS else np.int64
+        columns[field] = np.array([s[field] for s in studentList], dtype=dtype)
+
+    grades = np.full((len(sids), NUMSEMESTERS, len(SUBJECTS)), MISSING, dtype=np.int16)
+    for perf in scanPerformances(db, layout=layout):
+        row = np.searchsorted(sids, perf["sid"])
+        if(row < len(sids) and sids[row] == perf["sid"]):
+            grades[row, perf["time_period"]] = [perf[subj] for subj in SUBJECTS]
+    return Snapshot(sids, grades, columns)
+
+# Writes a Snapshot to disk as .npy files (written to a temporary folder first, then swapped in)
+# Input
+#   1) snapshot: the Snapshot
+#   2) fingerprint: collectionFingerprint of the data it was built from
+#   3) path: folder to save to
+def saveSnapshot(snapshot, fingerprint, path=SNAPSHOT_DIR):
+    tmpPath = path + ".tmp"
+    shutil.rmtree(tmpPath, ignore_errors=True)
+    os.makedirs(tmpPath)
+    np.save(os.path.join(tmpPath, "sids.npy"), snapshot.sids)
+    np.save(os.path.join(tmpPath, "grades.npy"), snapshot.grades)
+    for field, column in snapshot.columns.items():
+        np.save(os.path.join(tmpPath, "col_" + field + ".npy"), column)
+    with open(os.path.join(tmpPath, "meta.json"), "w") as f:
+        json.dump({"fingerprint": fingerprint, "columns": list(snapshot.columns)}, f)
+    shutil.rmtree(path, ignore_errors=True)
+    os.rename(tmpPath, path)
+
+# Opens a saved Snapshot with memory-mapped arrays
+# Input
+#   1) fingerprint: the current collectionFingerprint
+#   2) path: folder the Snapshot was saved to
+# Returns the Snapshot, or None if there is none or it is out of date
+def openSnapshot(fingerprint, path=SNAPSHOT_DIR):
+    try:
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if(meta["fingerprint"] != fingerprint):
+        return None
+    sids = np.load(os.path.join(path, "sids.npy"), mmap_mode="r")
+    grades = np.load(os.path.join(path, "grades.npy"), mmap_mode="r")
+    columns = {field: np.load(os.path.join(path, "col_" + field + ".npy"), mmap_mode="r") for field in meta["columns"]}
+    return Snapshot(sids, grades, columns)
+
+# Gets a Snapshot of the database, reusing the one on disk if the collections have not changed
+# Input
+#   1) db: main database
+#   2) layout: "rows" or "embedded", where the grades are read from
+#   3) path: cache folder
+# Returns a Snapshot
+def loadSnapshot(db, layout="rows", path=SNAPSHOT_DIR):
+    fingerprint = collectionFingerprint(db, layout)
+    snapshot = openSnapshot(fingerprint, path)
+    if(snapshot is None):
+        print("Building snapshot...")
+        snapshot = buildSnapshot(db, layout)
+        saveSnapshot(snapshot, fingerprint, path)
+        snapshot = openSnapshot(fingerprint, path)
+    return snapshot